@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 13:15:42 2026
+
+@author: Benedikt Goodman
+@email: benedikt.goodman@ssb.no
+
+Benchmarks for functions in dataframe_tools and import_helpers. Run from
+project root with:
+    python -m src.functions.benchmarks
+"""
+
+import os
+import tempfile
+import numpy as np
+import pandas as pd
+
+from src.functions.ts_tools.benchmarks import time_func
+from src.functions.dataframe_tools import (multiplier, divider,
+                                           proportion_func, column_arithmetic,
+                                           derive_columns, associate_codes,
+                                           associate_codes_batch,
+                                           reconcile_rounding)
+from src.functions.import_helpers import read_file
+
+
+def make_fee_data(n_rows: int, seed: int = 0) -> 'pd.DataFrame':
+    """Generates dataframe shaped like fee allocation data, with some zeroes
+    in the denominator column"""
+    rng = np.random.default_rng(seed)
+
+    return pd.DataFrame({
+        'aar': rng.integers(2010, 2023, n_rows),
+        'mengde': rng.uniform(0, 1000, n_rows),
+        'unntak': rng.integers(0, 2, n_rows),
+        'total_mengde': rng.choice([0.0, 5e5, 1e6], n_rows),
+        'total_avgift_kroner': rng.uniform(1e6, 1e7, n_rows),
+        'tekst': 'x',
+        })
+
+
+def benchmark_column_arithmetic(n_rows=(10_000, 1_000_000), repeats=3):
+    """
+    Compares three ways of calculating the same derived columns:
+        'copy'    = multiplier -> divider -> proportion_func, copying the
+                    frame in each step (default behaviour)
+        'inplace' = same chain with inplace=True
+        'batched' = a single call to column_arithmetic
+        'expression' = a single call to derive_columns
+
+    Raises AssertionError if results differ.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Best wall time in seconds per method.
+    """
+    rows = []
+
+    def chain(df, inplace):
+        df = multiplier(df, X='mengde', Y='unntak',
+                        new_col='avgiftsbelagt_mengde', inplace=inplace)
+        df = divider(df, X='avgiftsbelagt_mengde', Y='total_mengde',
+                     new_col='andel', inplace=inplace)
+        return proportion_func(df, X='avgiftsbelagt_mengde', Y='total_mengde',
+                               Z='total_avgift_kroner',
+                               new_col='est_avgift_kroner', inplace=inplace)
+
+    def batched(df):
+        return column_arithmetic(df, operations={
+            'avgiftsbelagt_mengde': ('multiply', 'mengde', 'unntak'),
+            'andel': ('divide', 'avgiftsbelagt_mengde', 'total_mengde'),
+            'est_avgift_kroner': ('proportion', 'avgiftsbelagt_mengde',
+                                  'total_mengde', 'total_avgift_kroner'),
+            }, inplace=True)
+
+    def expression(df):
+        return derive_columns(df, [
+            'avgiftsbelagt_mengde = mengde * unntak',
+            'andel = avgiftsbelagt_mengde / total_mengde',
+            'est_avgift_kroner = round(avgiftsbelagt_mengde / total_mengde * total_avgift_kroner)',
+            ], inplace=True)
+
+    for n in n_rows:
+        df = make_fee_data(n)
+
+        copy_time, copy_result = time_func(chain, df, False, repeats=repeats)
+
+        # Fresh frames for in-place methods, created outside of timing
+        inplace_time, inplace_result = time_func(
+            lambda: chain(df.copy(), True), repeats=1)
+        batched_time, batched_result = time_func(
+            lambda: batched(df.copy()), repeats=1)
+        expression_time, expression_result = time_func(
+            lambda: expression(df.copy()), repeats=1)
+
+        pd.testing.assert_frame_equal(copy_result, inplace_result)
+        pd.testing.assert_frame_equal(copy_result, batched_result)
+        pd.testing.assert_frame_equal(copy_result, expression_result)
+
+        rows.append([n, copy_time, inplace_time, batched_time, expression_time])
+
+    return pd.DataFrame(rows, columns=['n_rows', 'copy_s', 'inplace_s',
+                                       'batched_s', 'expression_s'])
+
+
+def make_code_data(n_rows: int, n_products: int, n_code_rows: int = 20_000,
+                   seed: int = 0) -> tuple:
+    """Generates data for n_products products and a table of
+    correspondences between industry codes and NR-codes for them"""
+    rng = np.random.default_rng(seed)
+
+    products = [f'Produkt{i:03d}' for i in range(n_products)]
+    ind_codes = [f'{i:02d}.{j}' for i in range(90) for j in range(10)]
+
+    df_codes = pd.DataFrame({
+        'produkt_tekst': rng.choice(products, n_code_rows),
+        'naaringskode': rng.choice(ind_codes, n_code_rows),
+        'nr_naaring': rng.choice([f'{i:05d}' for i in range(300)], n_code_rows),
+        })
+
+    df = pd.DataFrame({
+        'produkt_tekst': rng.choice(products, n_rows),
+        'naaringskode': rng.choice(ind_codes, n_rows),
+        'mengde': rng.uniform(0, 1000, n_rows),
+        })
+
+    return df, df_codes, products
+
+
+def benchmark_associate_codes(n_products=(5, 25, 50), n_rows=500_000,
+                              repeats=3):
+    """
+    Compares a loop calling associate_codes once per product with a single
+    call to associate_codes_batch.
+
+    Raises AssertionError if results differ.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Best wall time in seconds per method and speedup of batch method.
+    """
+    rows = []
+
+    def loop(df, df_codes, products):
+        parts = [associate_codes(df.loc[df['produkt_tekst'] == product],
+                                 df_codes=df_codes, prod_name=product)
+                 for product in products]
+        return pd.concat(parts).loc[df.index]
+
+    for n in n_products:
+        df, df_codes, products = make_code_data(n_rows, n)
+
+        loop_time, loop_result = time_func(loop, df, df_codes, products,
+                                           repeats=repeats)
+        batch_time, batch_result = time_func(associate_codes_batch, df,
+                                             df_codes=df_codes,
+                                             prod_names=products,
+                                             repeats=repeats)
+
+        pd.testing.assert_frame_equal(loop_result, batch_result)
+
+        rows.append([n, loop_time, batch_time])
+
+    results = pd.DataFrame(rows, columns=['n_products', 'loop_s', 'batch_s'])
+    results['speedup'] = results['loop_s'] / results['batch_s']
+
+    return results
+
+
+def max_rounding_reference(df: 'pd.DataFrame', group_cols: list) -> 'pd.DataFrame':
+    """Residual of each group added to its largest values with groupby
+    transforms, as the original rounding_error_dealer did. Missing values
+    are skipped in sums and maximums."""
+    df = df.copy()
+    keys = [df[col] for col in group_cols]
+    estimates = df.groupby(keys)['est_avgift_kroner']
+
+    residuals = (df.groupby(keys)['total_avgift_kroner'].transform('first')
+                 - estimates.transform('sum'))
+    is_max = estimates.transform('max') == df['est_avgift_kroner']
+    n_max = is_max.groupby(keys).transform('sum')
+
+    df['est_avgift_kroner'] = df['est_avgift_kroner'] + np.where(is_max, residuals / n_max, 0)
+    df['diff'] = residuals
+
+    return df
+
+
+def benchmark_reconcile_rounding(n_rows=(10_000, 1_000_000), repeats=3):
+    """
+    Compares reconcile_rounding(method='max') with groupby transforms as
+    in the original rounding_error_dealer, on groups of year and product
+    with tied maximums and missing estimates. Includes the case of a group
+    where an estimate is missing: year 2020, estimates [10, NaN, 5] and
+    total 17 gives [12, NaN, 5].
+
+    Raises AssertionError if results differ.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Best wall time in seconds per method and speedup of
+        reconcile_rounding.
+    """
+    rng = np.random.default_rng(0)
+    rows = []
+    group_cols = ['aar', 'produkt']
+
+    case = pd.DataFrame({'aar': 2020, 'produkt': 'x',
+                         'est_avgift_kroner': [10, np.nan, 5],
+                         'total_avgift_kroner': 17.0})
+    result = reconcile_rounding(case, group_cols=group_cols, residual_col='diff')
+    np.testing.assert_array_equal(result['est_avgift_kroner'], [12, np.nan, 5])
+    pd.testing.assert_frame_equal(result, max_rounding_reference(case, group_cols))
+
+    for n in n_rows:
+        df = pd.DataFrame({
+            'aar': rng.integers(2010, 2023, n),
+            'produkt': rng.choice(['bensin', 'diesel', 'fyringsolje'], n),
+            'est_avgift_kroner': rng.integers(0, 20, n).astype(float),
+            })
+        df.loc[rng.random(n) < 0.01, 'est_avgift_kroner'] = np.nan
+        df['total_avgift_kroner'] = (df.groupby(group_cols)['est_avgift_kroner']
+                                     .transform('sum') + rng.integers(-5, 6))
+
+        reference_time, reference_result = time_func(
+            max_rounding_reference, df, group_cols, repeats=repeats)
+        reconcile_time, reconcile_result = time_func(
+            reconcile_rounding, df, group_cols=group_cols, residual_col='diff',
+            repeats=repeats)
+
+        pd.testing.assert_frame_equal(reference_result, reconcile_result)
+
+        rows.append([n, reference_time, reconcile_time])
+
+    results = pd.DataFrame(rows, columns=['n_rows', 'groupby_s', 'reconcile_s'])
+    results['speedup'] = results['groupby_s'] / results['reconcile_s']
+
+    return results
+
+
+def recent_years(df: 'pd.DataFrame') -> 'pd.Series':
+    """Row filter for benchmark_chunked_read, defined at module level so it
+    can be sent to process pools"""
+    return df['aar'].astype(int) >= 2018
+
+
+def benchmark_chunked_read(n_rows=(100_000, 1_000_000), chunksize=100_000,
+                           repeats=3):
+    """
+    Compares reading a whole csv file and then selecting columns and rows,
+    with read_file streaming the same file in chunks with usecols, dtype and
+    row_filter.
+
+    Raises AssertionError if the two give different results.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Best wall time in seconds per method and speedup of the chunked read.
+    """
+    rows = []
+    usecols = ['aar', 'mengde']
+    dtype = {'mengde': float}
+
+    def whole_file(path):
+        df = pd.read_csv(path, sep=';', encoding='iso-8859-1', dtype=str)
+        df = df.rename(columns=lambda x: x.lower())[usecols].astype(dtype)
+        return df.loc[recent_years(df)].reset_index(drop=True)
+
+    with tempfile.TemporaryDirectory() as folder:
+        for n in n_rows:
+            path = os.path.join(folder, f'fee_{n}.csv')
+            make_fee_data(n).rename(columns=str.upper).to_csv(path, sep=';', index=False)
+
+            whole_time, whole_result = time_func(whole_file, path, repeats=repeats)
+
+            chunked_time, chunked_result = time_func(
+                read_file, path, filetype='csv', usecols=usecols, dtype=dtype,
+                chunksize=chunksize, row_filter=recent_years, repeats=repeats)
+
+            pd.testing.assert_frame_equal(whole_result, chunked_result)
+
+            rows.append([n, whole_time, chunked_time])
+
+    results = pd.DataFrame(rows, columns=['n_rows', 'whole_s', 'chunked_s'])
+    results['speedup'] = results['whole_s'] / results['chunked_s']
+
+    return results
+
+
+if __name__ == '__main__':
+    print(benchmark_column_arithmetic().to_string(index=False))
+    print(benchmark_associate_codes().to_string(index=False))
+    print(benchmark_chunked_read().to_string(index=False))
+    print(benchmark_reconcile_rounding().to_string(index=False))
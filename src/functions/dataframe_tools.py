@@ -14,17 +14,48 @@ input argumenter være tomme i funksjonen denne brukes på.
 """
 
 
+import re
+import ast
+import operator
 import pandas as pd
 import numpy as np
 import os
 from src.functions.utility_module import input_argument_none_eliminator
 
+# Optional, used by derive_columns when installed
+try:
+    import numexpr
+except ImportError:
+    numexpr = None
+
+
+# Syntax and functions allowed in derive_columns expressions
+_ALLOWED_NODES = (ast.Expression, ast.BinOp, ast.UnaryOp, ast.Call, ast.Name,
+                  ast.Constant, ast.Load, ast.Add, ast.Sub, ast.Mult, ast.Div,
+                  ast.Pow, ast.USub, ast.UAdd)
+_ARRAY_FUNCS = {'round': lambda x: np.round(x, 0), 'abs': np.abs}
+_GROUP_FUNCS = ['sum', 'mean', 'min', 'max']
+_NUMPY_OPS = {ast.Add: operator.add, ast.Sub: operator.sub,
+              ast.Mult: operator.mul, ast.Pow: operator.pow,
+              ast.USub: operator.neg, ast.UAdd: operator.pos}
+_NUMEXPR_OPS = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Pow: '**',
+                ast.USub: '-', ast.UAdd: '+'}
+
+
+def _safe_divide(x: 'np.ndarray', y: 'np.ndarray') -> 'np.ndarray':
+    """Divides x by y as float arrays. Outputs 0 where y is 0."""
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    return np.divide(x, y, out=np.zeros_like(x), where=y != 0)
+
 
 @input_argument_none_eliminator
 def multiplier(df_in:'pd.DataFrame', 
                X:str = None,
                Y:str = None,
-               new_col:str = None):
+               new_col:str = None,
+               inplace:bool = False):
     """
     Multiplies column X with column Y in df. Results are stored in df[new_col]
     
@@ -40,6 +71,9 @@ def multiplier(df_in:'pd.DataFrame',
         Numerical column values for multiplication.
     new_col : Dataframe column
         Column with results.
+    inplace : bool
+        If True, new_col is added to df_in instead of a copy of it.
+        The default is False.
 
     Returns
     -------
@@ -47,21 +81,23 @@ def multiplier(df_in:'pd.DataFrame',
         Dataframe with result column.
 
     """
-    df = df_in.copy()
-    df[new_col] = np.multiply(df[X], df[Y])
+    df = df_in if inplace else df_in.copy()
+    df[new_col] = np.multiply(df[X].to_numpy(), df[Y].to_numpy())
     return df
 
 @input_argument_none_eliminator
 def divider(df_in:'pd.DataFrame',
             X:str = None,
             Y:str = None,
-            new_col:str = None):
+            new_col:str = None,
+            inplace:bool = False):
     """
     Divides column X with column Y in df. Results are stored in df[new_col]
     
     new_col = df[X] / df[Y]
     
-    Will output 0 if Y is 0 to avoid zero-division errors
+    Will output 0 if Y is 0 to avoid zero-division errors. Results are
+    always floats, also when X and Y are integers.
 
     Parameters
     ----------
@@ -73,6 +109,9 @@ def divider(df_in:'pd.DataFrame',
         Numerical column values for division.
     new_col : Dataframe column
         Column with results.
+    inplace : bool
+        If True, new_col is added to df_in instead of a copy of it.
+        The default is False.
 
     Returns
     -------
@@ -80,10 +119,8 @@ def divider(df_in:'pd.DataFrame',
         Dataframe with result column.
 
     """
-    df = df_in.copy()
-    df[new_col] = np.divide(df[X], df[Y], 
-                            out=np.zeros_like(df[X]),
-                            where = df[Y] != 0)
+    df = df_in if inplace else df_in.copy()
+    df[new_col] = _safe_divide(df[X].to_numpy(), df[Y].to_numpy())
     return df
 
 @input_argument_none_eliminator
@@ -91,11 +128,14 @@ def proportion_func(df_in:'pd.DataFrame',
                     X:str = None,
                     Y:str = None,
                     Z:str = None,
-                    new_col:str = None):
+                    new_col:str = None,
+                    inplace:bool = False):
     """
     Generates new_col according to:
         new_col = (df[X]/df[Y]) * df[Z]
 
+    Outputs 0 where df[Y] is 0. Results are rounded to whole numbers.
+
     Parameters
     ----------
     df : Dataframe
@@ -108,6 +148,9 @@ def proportion_func(df_in:'pd.DataFrame',
         Name of column to designate as Z. Muliplies fraction. The default is None.
     new_col : string
         Name of new column generated.
+    inplace : bool
+        If True, new_col is added to df_in instead of a copy of it.
+        The default is False.
 
     Returns
     -------
@@ -115,14 +158,391 @@ def proportion_func(df_in:'pd.DataFrame',
         Output dataframe containing results.
 
     """
-    df = df_in.copy(deep=True)
-    df[new_col] = (np.divide(df[X], df[Y],
-                             out=np.zeros_like(df[X]),
-                            where = df[Y] != 0) * df[Z])
-    df[new_col] = df[new_col].round(0)
+    df = df_in if inplace else df_in.copy(deep=True)
+
+    # Multiplication and rounding done in the output array of the division
+    result = _safe_divide(df[X].to_numpy(), df[Y].to_numpy())
+    np.multiply(result, df[Z].to_numpy(dtype=float), out=result)
+    np.round(result, 0, out=result)
+
+    df[new_col] = result
+
+    return df
+
+
+@input_argument_none_eliminator
+def column_arithmetic(df_in: 'pd.DataFrame',
+                      operations: dict = None,
+                      inplace: bool = False):
+    """
+    Calculates several derived columns in one pass over the underlying
+    NumPy arrays, then adds them to the dataframe together.
+
+    Each input column is converted to an array once, no matter how many
+    operations use it. Later operations can use columns made by earlier
+    ones.
+
+    Syntax:
+        column_arithmetic(df, operations={
+            'avgiftsbelagt_mengde': ('multiply', 'mengde', 'unntak'),
+            'andel': ('divide', 'avgiftsbelagt_mengde', 'total_mengde'),
+            'est_avgift_kroner': ('proportion', 'avgiftsbelagt_mengde',
+                                  'total_mengde', 'total_avgift_kroner'),
+            })
+
+    Operations work as the functions of the same name:
+        'multiply'   = X * Y, see multiplier
+        'divide'     = X / Y with 0 where Y is 0, see divider
+        'proportion' = round((X / Y) * Z) with 0 where Y is 0, see
+                       proportion_func
+
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        Input dataframe.
+    operations : dict
+        New column names as keys, tuples of (operation, X, Y) or
+        ('proportion', X, Y, Z) as values. Evaluated in order.
+    inplace : bool
+        If True, columns are added to df_in instead of a copy of it.
+        The default is False.
+
+    Raises
+    ------
+    ValueError
+        Unknown operation or wrong number of columns for operation.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Dataframe with result columns.
+
+    """
+    n_columns = {'multiply': 2, 'divide': 2, 'proportion': 3}
+
+    # Arrays of columns used so far, including results
+    arrays = {}
+
+    def get_array(col):
+        if col not in arrays:
+            arrays[col] = df_in[col].to_numpy()
+        return arrays[col]
+
+    results = {}
+
+    for new_col, (operation, *cols) in operations.items():
+        if operation not in n_columns:
+            raise ValueError(f'Invalid operation {operation}. Valid operations are {list(n_columns)}')
+
+        if len(cols) != n_columns[operation]:
+            raise ValueError(f'{operation} takes {n_columns[operation]} columns, got {len(cols)}')
+
+        if operation == 'multiply':
+            result = np.multiply(get_array(cols[0]), get_array(cols[1]))
+
+        elif operation == 'divide':
+            result = _safe_divide(get_array(cols[0]), get_array(cols[1]))
+
+        elif operation == 'proportion':
+            result = _safe_divide(get_array(cols[0]), get_array(cols[1]))
+            np.multiply(result, np.asarray(get_array(cols[2]), dtype=float), out=result)
+            np.round(result, 0, out=result)
+
+        arrays[new_col] = result
+        results[new_col] = result
+
+    df = df_in if inplace else df_in.copy()
+
+    # New columns are only added once all are calculated
+    for new_col, result in results.items():
+        df[new_col] = result
+
+    return df
+
+
+def _parse_expression(expression: str) -> tuple:
+    """
+    Parses a derived column expression into (new_col, kind, spec, inputs).
+
+    Arithmetic expressions give kind 'arithmetic' with a parsed ast node as
+    spec. Group expressions, e.g. 'total = sum(mengde) by aar, produktkode',
+    give kind 'group' with (function, target, group columns) as spec.
+    """
+    if '=' not in expression:
+        raise ValueError(f'Expression must be on form "new_col = expression": {expression}')
+
+    new_col, rhs = [part.strip() for part in expression.split('=', 1)]
+
+    if not new_col.isidentifier():
+        raise ValueError(f'Invalid column name in expression: {new_col}')
+
+    group_match = re.fullmatch(r'(\w+)\(\s*(\w+)\s*\)\s+by\s+(.+)', rhs)
+
+    if group_match:
+        func, target, group = group_match.groups()
+        group = [col.strip() for col in group.split(',')]
+
+        if func not in _GROUP_FUNCS:
+            raise ValueError(f'Invalid group function {func}. Valid functions are {_GROUP_FUNCS}')
+
+        return new_col, 'group', (func, target, group), [target] + group
+
+    try:
+        node = ast.parse(rhs, mode='eval').body
+    except SyntaxError:
+        raise ValueError(f'Invalid expression: {expression}')
+
+    inputs = []
+
+    for sub_node in ast.walk(node):
+        if isinstance(sub_node, ast.Call):
+            if not (isinstance(sub_node.func, ast.Name)
+                    and sub_node.func.id in _ARRAY_FUNCS
+                    and len(sub_node.args) == 1):
+                raise ValueError(f'Only {list(_ARRAY_FUNCS)} with one argument can be called in expressions: {expression}')
+
+        elif isinstance(sub_node, ast.Name):
+            if sub_node.id not in _ARRAY_FUNCS:
+                inputs.append(sub_node.id)
+
+        elif isinstance(sub_node, ast.Constant):
+            if not isinstance(sub_node.value, (int, float)):
+                raise ValueError(f'Only numbers can be used as constants in expressions: {expression}')
+
+        elif not isinstance(sub_node, _ALLOWED_NODES):
+            raise ValueError(f'Unsupported syntax in expression: {expression}')
+
+    return new_col, 'arithmetic', node, inputs
+
+
+def _to_numexpr(node) -> str:
+    """Writes arithmetic ast node as numexpr string, with division by 0
+    giving 0 as in divider"""
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Div):
+        x, y = _to_numexpr(node.left), _to_numexpr(node.right)
+        return f'where(({y}) != 0, ({x}) / where(({y}) != 0, ({y}), 1), 0.0)'
+
+    if isinstance(node, ast.BinOp):
+        return f'({_to_numexpr(node.left)}) {_NUMEXPR_OPS[type(node.op)]} ({_to_numexpr(node.right)})'
+
+    if isinstance(node, ast.UnaryOp):
+        return f'{_NUMEXPR_OPS[type(node.op)]}({_to_numexpr(node.operand)})'
+
+    if isinstance(node, ast.Call):
+        return f'{node.func.id}({_to_numexpr(node.args[0])})'
+
+    if isinstance(node, ast.Name):
+        return node.id
+
+    return repr(float(node.value))
+
+
+def _evaluate_node(node, arrays: dict) -> 'np.ndarray':
+    """Evaluates arithmetic ast node on arrays. Subtrees without round are
+    evaluated with numexpr when it is installed, otherwise with NumPy."""
+    has_round = any(isinstance(sub_node, ast.Call) and sub_node.func.id == 'round'
+                    for sub_node in ast.walk(node))
+
+    if numexpr is not None and not has_round:
+        names = {sub_node.id for sub_node in ast.walk(node)
+                 if isinstance(sub_node, ast.Name) and sub_node.id not in _ARRAY_FUNCS}
+        return numexpr.evaluate(_to_numexpr(node),
+                                local_dict={name: arrays[name] for name in names})
+
+    if isinstance(node, ast.BinOp):
+        x, y = _evaluate_node(node.left, arrays), _evaluate_node(node.right, arrays)
+
+        if isinstance(node.op, ast.Div):
+            return _safe_divide(*np.broadcast_arrays(x, y))
+
+        return _NUMPY_OPS[type(node.op)](x, y)
+
+    if isinstance(node, ast.UnaryOp):
+        return _NUMPY_OPS[type(node.op)](_evaluate_node(node.operand, arrays))
+
+    if isinstance(node, ast.Call):
+        return _ARRAY_FUNCS[node.func.id](_evaluate_node(node.args[0], arrays))
+
+    if isinstance(node, ast.Name):
+        return arrays[node.id]
+
+    return node.value
+
+
+def _group_codes(key_arrays: list) -> tuple:
+    """Returns integer group code per row and number of groups. Rows with
+    missing values in any key get code -1, as groupby drops them."""
+    codes, uniques = pd.factorize(key_arrays[0], sort=False)
+    n_groups = len(uniques)
+
+    # Combines codes of one more key at a time
+    for keys in key_arrays[1:]:
+        key_codes, key_uniques = pd.factorize(keys, sort=False)
+        valid = (codes != -1) & (key_codes != -1)
+        combined = codes[valid] * len(key_uniques) + key_codes[valid]
+
+        codes = np.full(len(codes), -1, dtype=np.int64)
+        codes[valid], uniques = pd.factorize(combined, sort=False)
+        n_groups = len(uniques)
+
+    return codes, n_groups
+
+
+def _group_transform(func: str, values: 'np.ndarray', codes: 'np.ndarray',
+                     n_groups: int) -> 'np.ndarray':
+    """Group sum, mean, min or max broadcast back to rows, like
+    groupby().transform(). Missing values are skipped."""
+    values = np.asarray(values, dtype=float)
+    valid = (codes != -1) & ~np.isnan(values)
+    group_codes, group_values = codes[valid], values[valid]
+
+    if func in ['sum', 'mean']:
+        result = np.bincount(group_codes, weights=group_values, minlength=n_groups)
+
+        if func == 'mean':
+            counts = np.bincount(group_codes, minlength=n_groups)
+            result = np.divide(result, counts, out=np.full(n_groups, np.nan),
+                               where=counts != 0)
+
+    else:
+        result = np.full(n_groups, np.inf if func == 'min' else -np.inf)
+        (np.minimum if func == 'min' else np.maximum).at(result, group_codes, group_values)
+        result[np.isinf(result)] = np.nan
+
+    # Rows without a group get missing value
+    return np.where(codes != -1, result[codes], np.nan)
+
+
+def _plan_expressions(parsed: list, available: 'pd.Index') -> list:
+    """Orders parsed expressions so each is evaluated after the derived
+    columns it uses. Raises ValueError on unknown columns or cycles."""
+    derived = {item[0]: item for item in parsed}
+
+    if len(derived) != len(parsed):
+        raise ValueError('Each derived column can only be defined once')
+
+    order, state = [], {}
+
+    def visit(new_col):
+        if state.get(new_col) == 'done':
+            return
+        if state.get(new_col) == 'visiting':
+            raise ValueError(f'Circular reference involving column {new_col}')
+
+        state[new_col] = 'visiting'
+
+        for col in derived[new_col][3]:
+            if col in derived and col != new_col:
+                visit(col)
+            elif col not in available:
+                raise ValueError(f'Column {col} used in expression for {new_col} not found in dataframe')
+
+        state[new_col] = 'done'
+        order.append(derived[new_col])
+
+    for new_col in derived:
+        visit(new_col)
+
+    return order
+
+
+def derive_columns(df_in: 'pd.DataFrame',
+                   expressions: 'str or list' = None,
+                   inplace: bool = False):
+    """
+    Calculates derived columns declared as expressions, e.g.
+
+        derive_columns(df, [
+            'avgiftsbelagt_mengde = mengde * unntak',
+            'total_mengde = sum(avgiftsbelagt_mengde) by aar, produktkode',
+            'est_avgift_kroner = round(avgiftsbelagt_mengde / total_mengde * total_avgift_kroner)',
+            ])
+
+    replaces a chain of multiplier, make_sum_column and proportion_func.
+
+    All expressions are parsed and ordered by dependency first, so they can
+    be given in any order. Each input column is converted to an array once,
+    and the results are added to the dataframe together at the end, so no
+    intermediate copies of the dataframe are made.
+
+    Arithmetic expressions support +, -, *, /, ** and the functions round
+    and abs, on columns and numbers. Division by 0 gives 0, as in divider.
+    They are evaluated with numexpr when it is installed, and with NumPy
+    otherwise.
+
+    Group expressions are on form 'new_col = func(target) by col1, col2',
+    where func is sum, mean, min or max. The result is broadcast back to
+    every row as in make_sum_column. Missing values are skipped.
+
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        Input dataframe.
+    expressions : str or list
+        Expression or list of expressions on form 'new_col = expression'.
+        Expressions can use columns defined in other expressions.
+    inplace : bool
+        If True, columns are added to df_in instead of a copy of it.
+        The default is False.
+
+    Raises
+    ------
+    ValueError
+        Invalid expressions, unknown columns or circular references.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Dataframe with derived columns.
+
+    """
+    if isinstance(expressions, str):
+        expressions = [expressions]
+
+    plan = _plan_expressions([_parse_expression(expression)
+                              for expression in expressions], df_in.columns)
+
+    # Arrays of columns used so far, including results
+    arrays = {}
+    results = {}
+    group_cache = {}
+
+    def get_array(col):
+        if col not in arrays:
+            arrays[col] = df_in[col].to_numpy()
+        return arrays[col]
+
+    for new_col, kind, spec, inputs in plan:
+        for col in inputs:
+            get_array(col)
+
+        if kind == 'group':
+            func, target, group = spec
+
+            # Groupings are reused by expressions with the same group columns
+            if tuple(group) not in group_cache:
+                group_cache[tuple(group)] = _group_codes([arrays[col] for col in group])
+
+            result = _group_transform(func, arrays[target], *group_cache[tuple(group)])
+
+        else:
+            result = _evaluate_node(spec, arrays)
+
+            # Expressions of constants only are expanded to full columns
+            result = np.broadcast_to(result, len(df_in)).copy() if np.ndim(result) == 0 else result
+
+        arrays[new_col] = result
+        results[new_col] = result
+
+    df = df_in if inplace else df_in.copy()
+
+    # New columns are only added once all are calculated
+    for new_col, result in results.items():
+        df[new_col] = result
 
     return df
 
+
 # Function for dropping filename from dataframe
 # For filling inn unntak
 def unntak_filler(df: pd.DataFrame, col='unntak'):
@@ -299,8 +719,10 @@ def merge_func(df_l: 'pd.DataFrame',
     ----------
     df_l : Dataframe
         Left dataframe
-    df_r : Dataframe
-        Right dataframe
+    df_r : Dataframe or PreparedLookup
+        Right dataframe. If df_r is a PreparedLookup the join columns and
+        fill options it was made with are used, and subset_columns_r,
+        join_on and fill arguments are ignored.
     subset_columns_r : string or list of strings
         Columns from df_r to join onto df_l. If no subset is defined 
         the function defaults to joining all functions onto left.
@@ -318,6 +740,10 @@ def merge_func(df_l: 'pd.DataFrame',
         Merged dataframe with df_l and columns from df_r.
 
     """
+    # Prepared lookups are indexed already
+    if isinstance(df_r, PreparedLookup):
+        return df_r.merge(df_l, join_method=join_method)
+
     if subset_columns_r is None:
         subset_columns_r = df_r.columns
 
@@ -325,9 +751,9 @@ def merge_func(df_l: 'pd.DataFrame',
         print('Error: join_on argument is empty. Please define which column you want to join on.')
         return None
 
-    # Merges dataframes
+    # Merges dataframes, pd.merge returns a new dataframe so inputs are not copied
     merged_df = pd.merge(
-        df_l.copy(), df_r[subset_columns_r].copy(), on=join_on, how=join_method
+        df_l, df_r[subset_columns_r], on=join_on, how=join_method
     )
     
     
@@ -345,6 +771,214 @@ def merge_func(df_l: 'pd.DataFrame',
     return merged_df
 
 
+class PreparedLookup():
+    """
+    Right hand side of merge_func prepared for repeated joins.
+
+    The join keys of df_r are indexed once when the lookup is made, and so
+    is the fill_based_on -> fill_target_col mapping used by merge_func when
+    fill=True. The lookup can then be joined onto many left dataframes, e.g.
+    in a loop over products, without copying or re-indexing df_r.
+
+    Syntax:
+        lookup = PreparedLookup(ytart_table, subset_columns_r=['produktkode', 'ytart'],
+                                join_on=['produktkode'])
+        for product, df in product_dfs.items():
+            product_dfs[product] = lookup.merge(df)
+
+    or equivalently merge_func(df, lookup).
+
+    Left joins on keys that are unique in df_r are done by looking up row
+    positions in the index and taking the right hand columns by position.
+    Other joins, and joins where the key dtypes or column names do not line
+    up, fall back to pd.merge. Both give the same result.
+    """
+
+    def __init__(self,
+                 df_r: 'pd.DataFrame',
+                 subset_columns_r: list = None,
+                 join_on: list = None,
+                 fill: bool = True,
+                 fill_target_col: str = 'ytart',
+                 fill_based_on: str = 'produktkode'):
+        """
+        Parameters are as for merge_func. join_on must be given.
+        """
+        if join_on is None:
+            raise ValueError('join_on argument is empty. Please define which column you want to join on.')
+
+        if isinstance(join_on, str):
+            join_on = [join_on]
+
+        if subset_columns_r is None:
+            subset_columns_r = df_r.columns
+
+        self.join_on = list(join_on)
+        self.df_r = df_r[subset_columns_r]
+        self.value_columns = [col for col in self.df_r.columns if col not in self.join_on]
+
+        # Positions of rows in df_r by join key
+        keys = self.df_r[self.join_on]
+        self.key_index = (pd.Index(keys.iloc[:, 0]) if len(self.join_on) == 1
+                          else pd.MultiIndex.from_frame(keys))
+        self.unique_keys = self.key_index.is_unique
+
+        # Same associations as dict(zip(...)) in merge_func, last value wins
+        self.fill = fill
+        self.fill_target_col = fill_target_col
+        self.fill_based_on = fill_based_on
+
+        if fill is True:
+            fill_map = pd.Series(df_r[fill_target_col].to_numpy(),
+                                 index=df_r[fill_based_on].to_numpy())
+            self.fill_map = fill_map[~fill_map.index.duplicated(keep='last')]
+
+    def __can_take(self, df_l: 'pd.DataFrame', join_method: str):
+        """Checks if join can be done by position lookup"""
+        return (join_method == 'left'
+                and self.unique_keys
+                and all(df_l[col].dtype == self.df_r[col].dtype for col in self.join_on)
+                and not set(self.value_columns) & set(df_l.columns))
+
+    def positions(self, df_l: 'pd.DataFrame'):
+        """Row positions in df_r matching each row of df_l, -1 if no match"""
+        keys = df_l[self.join_on]
+
+        if len(self.join_on) == 1:
+            return self.key_index.get_indexer(keys.iloc[:, 0])
+
+        return self.key_index.get_indexer(pd.MultiIndex.from_frame(keys))
+
+    def merge(self, df_l: 'pd.DataFrame', join_method: str = 'left'):
+        """
+        Joins prepared df_r onto df_l, as merge_func.
+
+        Parameters
+        ----------
+        df_l : pd.DataFrame
+            Left dataframe.
+        join_method : str
+            Supports left, right, inner and outer. The default is 'left'.
+
+        Returns
+        -------
+        merged_df : pd.DataFrame
+            Merged dataframe with df_l and columns from df_r.
+
+        """
+        if self.__can_take(df_l, join_method):
+            positions = self.positions(df_l)
+            merged_df = df_l.reset_index(drop=True)
+
+            for col in self.value_columns:
+                merged_df[col] = pd.api.extensions.take(
+                    self.df_r[col].array, positions, allow_fill=True)
+
+        else:
+            merged_df = pd.merge(df_l, self.df_r, on=self.join_on, how=join_method)
+
+        if self.fill is True:
+            positions = self.fill_map.index.get_indexer(merged_df[self.fill_based_on])
+            merged_df[self.fill_target_col] = pd.api.extensions.take(
+                self.fill_map.array, positions, allow_fill=True)
+
+        return merged_df
+
+
+class SubsetCache():
+    """
+    Index of row positions by column value for datasets in the data dict,
+    used by subsetter and multi_subsetter.
+
+    The first time a column of a dataset is filtered on, a mapping from each
+    value in it to the positions of the rows holding it is made. Later
+    filters on the same column look positions up in it, and criteria on
+    several columns are combined by intersecting positions, so repeated
+    filters cost about the size of the result instead of the size of the
+    dataset. Only the selected rows are copied.
+
+    Syntax:
+        cache = SubsetCache(data)
+        jet = multi_subsetter(cache, key='forbruk', aar=2021, produktkode='Jetparafin')
+
+    Indexes are rebuilt if a dataset in the dict is replaced by another
+    dataframe. If a dataset is changed in place, call invalidate(key).
+    """
+
+    def __init__(self, data: dict):
+        """
+        Parameters
+        ----------
+        data : dict
+            Dictionary containing datasets. Dataset names = keys, datasets =
+            values.
+        """
+        self.data = data
+        self.indexes = {}
+        self.frames = {}
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+    def invalidate(self, key=None):
+        """Drops indexes of key, or of all datasets if key is None"""
+        for cached_key in [key] if key is not None else list(self.indexes):
+            self.indexes.pop(cached_key, None)
+            self.frames.pop(cached_key, None)
+
+        return self
+
+    def index(self, key, column: str) -> dict:
+        """Returns dict of value -> sorted row positions for column in dataset"""
+        df = self.data[key]
+
+        # Dataset replaced since indexes were made
+        if self.frames.get(key) is not df:
+            self.invalidate(key)
+            self.frames[key] = df
+            self.indexes[key] = {}
+
+        if column not in self.indexes[key]:
+            self.indexes[key][column] = df.groupby(column, sort=False).indices
+
+        return self.indexes[key][column]
+
+    def positions(self, key, **criteria) -> 'np.ndarray':
+        """
+        Returns sorted positions of rows in dataset where every column equals
+        its value. A list of values selects rows equal to any of them.
+        """
+        empty = np.array([], dtype=np.int64)
+        matches = []
+
+        for column, value in criteria.items():
+            index = self.index(key, column)
+
+            if isinstance(value, (list, tuple, set)):
+                found = [index[item] for item in value if item in index]
+                # Repeated values in list would otherwise repeat rows
+                matches.append(np.unique(np.concatenate(found)) if found else empty)
+            else:
+                matches.append(index.get(value, empty))
+
+        if not matches:
+            return np.arange(len(self.data[key]))
+
+        # Intersects from smallest set of positions up
+        matches.sort(key=len)
+        result = matches[0]
+
+        for other in matches[1:]:
+            idx = np.searchsorted(other, result).clip(max=max(len(other) - 1, 0))
+            result = result[other[idx] == result] if len(other) else empty
+
+        return result
+
+    def subset(self, key, **criteria) -> 'pd.DataFrame':
+        """Returns rows of dataset where every column equals its value"""
+        return self.data[key].take(self.positions(key, **criteria))
+
+
 @input_argument_none_eliminator
 def subsetter(data: dict,
               key: 'name of dataset in dictionary as str' = None, 
@@ -361,9 +995,10 @@ def subsetter(data: dict,
 
     Parameters
     ----------
-    data : Dictionary
+    data : Dictionary or SubsetCache
         Dictionary containing all datasets. Dataset names = keys, datasets = 
-        values. Can be access by data[key].
+        values. Can be access by data[key]. If a SubsetCache is given, its
+        cached indexes are used for filtering.
     key : string
         Name of dataset to subset from.
     variable : String
@@ -383,7 +1018,10 @@ def subsetter(data: dict,
         Filtered subset of your input dataframe
 
     """
-    subset = data[key].loc[data[key][var] == value].copy()
+    if isinstance(data, SubsetCache):
+        subset = data.subset(key, **{var: value})
+    else:
+        subset = data[key].loc[data[key][var] == value].copy()
 
     if dtype_convert is True:
         # Change specified columns to desired datatype
@@ -412,9 +1050,14 @@ def multi_subsetter(data: dict,
         Built on df.query, translates kwargs into a dictionary and
         uses that dictionary for subsetting
 
+    If data is a SubsetCache, rows are instead looked up in cached indexes
+    of the columns, which is much faster for repeated filtering. Values are
+    then compared as they are, not as strings, and a list of values
+    selects rows equal to any of them.
+
     Parameters
     ----------
-    data : Dictionary
+    data : Dictionary or SubsetCache
         Dictionary containing all datasets. Dataset names = keys, datasets = 
         values. Can be access by data[key].
     key : string
@@ -429,11 +1072,14 @@ def multi_subsetter(data: dict,
         Filtered subset of your input dataframe
 
     """
+    if isinstance(data, SubsetCache):
+        return data.subset(key, **criteria)
+
     # Make mask formatted ti query syntax
     mask = ' and '.join(["{} == '{}'".format(k,v) for k,v in criteria.items()])   
     
-    # make subset
-    subset = data[key].copy(deep=True).query(mask)
+    # make subset, query returns a new dataframe so data is not copied first
+    subset = data[key].query(mask)
 
     return subset
 
@@ -507,6 +1153,133 @@ def associate_codes(df_in: 'pd.DataFrame',
     return df
 
 
+def _match_names(values: 'pd.Series', names: list) -> tuple:
+    """
+    Matches values against each name as str.contains(name) does, but only
+    once per unique value.
+
+    Returns integer code of unique value per row (-1 for missing values)
+    and a boolean array with a row per unique value and a column per name.
+    A final all False row is added so codes of -1 never match.
+    """
+    codes, uniques = pd.factorize(values, sort=False)
+
+    matches = np.zeros((len(uniques) + 1, len(names)), dtype=bool)
+
+    for i, value in enumerate(uniques):
+        matches[i] = [re.search(name, str(value)) is not None for name in names]
+
+    return codes, matches
+
+
+def associate_codes_batch(df_in: 'pd.DataFrame',
+                          df_codes: 'pd.DataFrame' = None,
+                          ind_code_col: str = 'naaringskode',
+                          nr_code_col: str = 'nr_naaring',
+                          prod_name_col: str = 'produkt_tekst',
+                          prod_names: list = None,
+                          product_col: str = None):
+    """
+    Same as associate_codes, for many products at once.
+
+    Instead of one call to associate_codes per product, each scanning the
+    full code table, product names are matched against the unique product
+    texts of df_codes once, and the correspondences between ind_code_col
+    and nr_code_col for all products are joined onto df_in in one merge on
+    categorical keys.
+
+    Rows in df_in are assigned to the first name in prod_names found in
+    product_col, using the same substring matching as for df_codes. Rows
+    that match no product get missing values in nr_code_col.
+
+    Syntax:
+        associate_codes_batch(df, df_codes=data['omkoding_nr'],
+                              prod_names=['Jetparafin', 'Autodiesel'])
+
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        Dataframe containing data and set of codes (NACE codes for example)
+        you want to map new codes to (NR-codes), for several products.
+    df_codes : pd.DataFrame
+       Dataframe containing correspondences between old codes (NACE) and new
+       codes (NR-codes). The default is None.
+    ind_code_col : str
+        Dataframe column in df_in containing codes to use map correspondences
+        on. The default is 'naaringskode'.
+    nr_code_col : str
+        Dataframe column containing codes you want to map to new column in
+        df_in. The default is 'nr_naaring'.
+    prod_name_col : str
+        Dataframe column in df_codes containing product names. The default
+        is 'produkt_tekst'.
+    prod_names : list
+        Product names to make correspondences for. NB: Is case sensitive.
+        Must be given, a single name is also accepted. The default is None.
+    product_col : str
+        Dataframe column in df_in containing product names. If None,
+        prod_name_col is used. The default is None.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Output dataframe containing source data and new column w/ new codes
+
+    """
+    if isinstance(prod_names, str):
+        prod_names = [prod_names]
+
+    if not pd.api.types.is_list_like(prod_names) or len(prod_names) == 0:
+        raise ValueError('prod_names must be a product name or a non-empty list of product names, '
+                         f'got {prod_names!r}')
+
+    if len(set(prod_names)) != len(prod_names):
+        raise ValueError('prod_names contains duplicates')
+
+    if product_col is None:
+        product_col = prod_name_col
+
+    # Rows in df_codes used by each product, as in associate_codes
+    text_codes, text_matches = _match_names(df_codes[prod_name_col], prod_names)
+    row_idx, prod_idx = np.nonzero(text_matches[text_codes])
+
+    # Correspondences for all products, last value wins as in dict(zip())
+    corr = pd.DataFrame({
+        'product': prod_idx,
+        ind_code_col: df_codes[ind_code_col].to_numpy()[row_idx],
+        nr_code_col: df_codes[nr_code_col].to_numpy()[row_idx]
+        }).drop_duplicates(['product', ind_code_col], keep='last')
+
+    # Product of each row in df_in, -1 if none
+    in_codes, in_matches = _match_names(df_in[product_col], prod_names)
+    in_products = np.where(in_matches.any(axis=1), in_matches.argmax(axis=1), -1)[in_codes]
+
+    # Categorical keys with shared categories. Codes not in df_in can not match
+    # and are dropped
+    code_values, code_uniques = pd.factorize(df_in[ind_code_col], sort=False)
+    corr_code_values = pd.Index(code_uniques).get_indexer(corr[ind_code_col])
+    corr = corr.loc[corr_code_values != -1]
+    corr_code_values = corr_code_values[corr_code_values != -1]
+
+    product_categories = pd.Index(prod_names)
+    left_keys = pd.DataFrame({
+        'product': pd.Categorical.from_codes(in_products, product_categories),
+        'code': pd.Categorical.from_codes(code_values, code_uniques)
+        })
+    right = pd.DataFrame({
+        'product': pd.Categorical.from_codes(corr['product'].to_numpy(), product_categories),
+        'code': pd.Categorical.from_codes(corr_code_values, code_uniques),
+        nr_code_col: corr[nr_code_col].to_numpy()
+        })
+
+    merged = pd.merge(left_keys, right, on=['product', 'code'], how='left')
+
+    df = df_in.copy()
+    df[nr_code_col] = merged[nr_code_col].to_numpy()
+
+    return df
+
+
 @input_argument_none_eliminator
 def column_tidy_func(df_in, 
                      keep_cols=None, 
@@ -603,12 +1376,185 @@ def diff_maker(df, year_col='aar', total_fee_col='total_avgift_kroner', est_fee_
     return subset['diff']
 
 
+def _group_rank(codes: 'np.ndarray', key: 'np.ndarray') -> 'np.ndarray':
+    """Rank of each row within its group by key, largest first. Ties are
+    ranked by row order."""
+    order = np.lexsort((-key, codes))
+    counts = np.bincount(codes)
+    starts = np.cumsum(counts) - counts
+
+    ranks = np.empty(len(codes), dtype=np.int64)
+    ranks[order] = np.arange(len(codes)) - starts[codes[order]]
+
+    return ranks
+
+
+def _spread_units(units: 'np.ndarray', codes: 'np.ndarray',
+                  ranks: 'np.ndarray') -> 'np.ndarray':
+    """Spreads a whole number of units per group over its rows, one unit
+    at a time in rank order, going round again if there are more units than
+    rows. Returns signed number of units per row."""
+    counts = np.bincount(codes)[codes]
+    n_units = np.abs(units)[codes]
+
+    return np.sign(units)[codes] * (n_units // counts + (ranks < n_units % counts))
+
+
+def reconcile_rounding(df_in: 'pd.DataFrame',
+                       value_col: str = 'est_avgift_kroner',
+                       total_col: str = 'total_avgift_kroner',
+                       group_cols: list = None,
+                       method: str = 'max',
+                       weight_col: str = None,
+                       decimals: int = 0,
+                       residual_col: str = None,
+                       inplace: bool = False):
+    """
+    Makes values in value_col sum to the known total in total_col within
+    each group, e.g. per year, product and ytart, by allocating the
+    difference (residual) from rounding back to the values.
+
+    Groups are factorized once and all sums, maximums and ranks are
+    calculated for all groups together, so the number of passes over the
+    data is the same no matter how many groups there are.
+
+    Methods:
+        'max'               = residual added to largest value in group,
+                              split evenly if several rows share it. Same
+                              as rounding_error_dealer.
+        'proportional'      = residual spread in proportion to values,
+                              evenly if values sum to 0. Not rounded.
+        'largest_remainder' = residual spread one unit (10**-decimals) at a
+                              time to rows rounded down the most, or taken
+                              from rows rounded up the most if residual is
+                              negative. Rounding is measured against the
+                              unrounded values in weight_col.
+        'hamilton'          = total apportioned from scratch in proportion to
+                              weight_col (value_col if None): each row gets
+                              its quota rounded down, and the units left go
+                              to rows with the largest remainders. Result is
+                              whole units that sum exactly to the total.
+
+    Parameters
+    ----------
+    df_in : pd.DataFrame
+        Input dataframe.
+    value_col : str
+        Column with rounded values to reconcile. The default is
+        'est_avgift_kroner'.
+    total_col : str
+        Column with known total per group. Should be the same within a
+        group, the first value of each group is used. The default is
+        'total_avgift_kroner'.
+    group_cols : str or list
+        Columns identifying groups. Rows with missing values in these are
+        left as they are. The default is None, which means ['aar'].
+    method : str
+        'max', 'proportional', 'largest_remainder' or 'hamilton'.
+        The default is 'max'.
+    weight_col : str
+        Column with unrounded values. Required by 'largest_remainder',
+        optional for 'hamilton'. The default is None.
+    decimals : int
+        Number of decimals values are rounded to, sets size of units for
+        'largest_remainder' and 'hamilton'. The default is 0.
+    residual_col : str
+        If given, residual of each group before reconciliation is added to
+        the output in this column. The default is None.
+    inplace : bool
+        If True, df_in is changed instead of a copy of it. The default is
+        False.
+
+    Raises
+    ------
+    ValueError
+        Invalid method, or missing weight_col for 'largest_remainder'.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Dataframe with reconciled values in value_col.
+
+    """
+    allowed_methods = ['max', 'proportional', 'largest_remainder', 'hamilton']
+
+    if method not in allowed_methods:
+        raise ValueError(f'Invalid method {method}. Valid methods are {allowed_methods}')
+
+    if method == 'largest_remainder' and weight_col is None:
+        raise ValueError('weight_col with unrounded values is required for largest_remainder')
+
+    if group_cols is None:
+        group_cols = ['aar']
+
+    elif isinstance(group_cols, str):
+        group_cols = [group_cols]
+
+    codes, n_groups = _group_codes([df_in[col].to_numpy() for col in group_cols])
+    valid = codes != -1
+    codes = codes[valid]
+
+    values = df_in[value_col].to_numpy(dtype=float)[valid]
+    totals_in = df_in[total_col].to_numpy(dtype=float)[valid]
+
+    # Sums and first total per group
+    sums = np.bincount(codes, weights=np.nan_to_num(values), minlength=n_groups)
+    totals = np.empty(n_groups)
+    totals[codes[::-1]] = totals_in[::-1]
+    residuals = totals - sums
+
+    unit = 10.0 ** -decimals
+
+    if method == 'max':
+        # fmax skips missing values, as sum does above
+        group_max = np.full(n_groups, -np.inf)
+        np.fmax.at(group_max, codes, values)
+        is_max = values == group_max[codes]
+        n_max = np.bincount(codes[is_max], minlength=n_groups)
+        new_values = values + np.where(is_max, residuals[codes] / np.maximum(n_max, 1)[codes], 0)
+
+    elif method == 'proportional':
+        counts = np.bincount(codes, minlength=n_groups)
+        shares = np.where(sums[codes] != 0,
+                          _safe_divide(values, sums[codes]),
+                          1 / counts[codes])
+        new_values = values + residuals[codes] * shares
+
+    elif method == 'largest_remainder':
+        # Positive remainder means value was rounded down
+        remainders = df_in[weight_col].to_numpy(dtype=float)[valid] - values
+        units = np.round(residuals / unit).astype(np.int64)
+        ranks = _group_rank(codes, np.sign(units)[codes] * remainders)
+        new_values = values + _spread_units(units, codes, ranks) * unit
+
+    elif method == 'hamilton':
+        weights = (df_in[weight_col] if weight_col else df_in[value_col]).to_numpy(dtype=float)[valid]
+        weight_sums = np.bincount(codes, weights=weights, minlength=n_groups)
+        quotas = _safe_divide(weights, weight_sums[codes]) * totals[codes] / unit
+        floors = np.floor(quotas)
+        units = (np.round(totals / unit)
+                 - np.bincount(codes, weights=floors, minlength=n_groups)).astype(np.int64)
+        ranks = _group_rank(codes, quotas - floors)
+        new_values = (floors + _spread_units(units, codes, ranks)) * unit
+
+    df = df_in if inplace else df_in.copy()
+
+    df.loc[valid, value_col] = new_values
+
+    if residual_col is not None:
+        df[residual_col] = np.nan
+        df.loc[valid, residual_col] = residuals[codes]
+
+    return df
+
+
 # Velger ut produkter som skal omregnes til mineralolje
 def rounding_error_dealer(df_in,
                           estimated_fee_col='est_avgift_kroner',
                           year_col='aar',
                           total_fee_col = 'total_avgift_kroner',
-                          diff_func = diff_maker):
+                          diff_func = None,
+                          group_cols = None):
     """
     Takes the difference between a column of a known total and compares
     it with a column of disaggregated values of the total. If there is any
@@ -618,6 +1564,9 @@ def rounding_error_dealer(df_in,
     If there are multiple largest values the function will divide the 
     difference and spread them across the n largest observations.
 
+    Built on reconcile_rounding with method='max', see it for other ways
+    of allocating the difference.
+
     Parameters
     ----------
     df_in : pd.DataFrame
@@ -629,57 +1578,33 @@ def rounding_error_dealer(df_in,
     total_fee_col : str
         Known total sum. The default is 'total_avgift_kroner'.
     diff_func : Function
-        Function used to calculate differences between known total and 
-        estimated disaggregated values. The default is diff_maker.
+        Deprecated and not used, differences are calculated per group in
+        group_cols. A warning is printed if given. The default is None.
+    group_cols : list
+        Columns to reconcile totals within, e.g. ['aar', 'produktkode'].
+        If None, only year_col is used. The default is None.
 
     Yields
     ------
     df : pd.DataFrame
-        Dataframe with corrected values
+        Dataframe with corrected values, and difference per group before
+        correction in column 'diff'
 
     """
-
-    df = df_in.copy(deep=True)
-
-    # Calculate diff column
-    df['diff'] = df.pipe(diff_func,
-                         year_col = year_col,
-                         total_fee_col = total_fee_col,
-                         est_fee_col = estimated_fee_col, 
-                    )
-
-    # Calculate total yearly fee
-    total_yearly_fee = (df
-                        .groupby(year_col)[estimated_fee_col]
-                        .sum()
-                        .rename('est_total'))
-
-    # Indicate index subset for largest estimated fees in df
-    idx = (df
-           .groupby(year_col, sort=False)[estimated_fee_col]
-           .transform(max) == df[estimated_fee_col])
-
-    # Count amount of max values per year in max value subset
-    # will yield >1 if there are identical max values within a year
-    max_vals_per_year = (df.loc[idx]
-                         .groupby(year_col)[estimated_fee_col]
-                         .count().rename('n_max_obs'))
-
-    df = df.merge(max_vals_per_year, on=year_col)
-
-    # Attribute diff values to largest observation
-    # divide by n largest if there are several
-    factor = np.divide(df.loc[idx]['diff'], df.loc[idx]['n_max_obs'])
-    corrected_fees = df.loc[idx][estimated_fee_col] + factor
-
-    # Add results to dataset where applicable, then merge into column
-    df['corr_fees'] = corrected_fees
-    df[estimated_fee_col] = np.where(df['corr_fees'].notna(),
-                                     df['corr_fees'],
-                                     df[estimated_fee_col])
-
-
-    return df
+    if diff_func is not None:
+        print('Warning: diff_func is deprecated and not used by rounding_error_dealer. \n'
+              'Differences are calculated per group in group_cols, use \n'
+              'reconcile_rounding for other ways of allocating them.')
+
+    if group_cols is None:
+        group_cols = [year_col]
+
+    return reconcile_rounding(df_in,
+                              value_col=estimated_fee_col,
+                              total_col=total_fee_col,
+                              group_cols=group_cols,
+                              method='max',
+                              residual_col='diff')
 
 
 def rename_multiple_columns(df_in: 'pd.DataFrame', old_substring: str , new_substring: str) -> 'pd.DataFrame':
@@ -8,18 +8,74 @@ Created on Wed Feb  1 09:12:18 2023
 
 import os
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+
+def write_file(df: 'pd.DataFrame', path: str, filetype: str = 'xlsx',
+               sep_sign: str = ';'):
+    """
+    Writes dataframe to path in the given filetype. Defined at module level
+    so it can be sent to both thread and process pools by batch_exporter.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Dataframe to write.
+    path : str
+        Path of file to write.
+    filetype : str
+        'xlsx', 'csv', 'parquet' or 'feather'. The default is 'xlsx'.
+    sep_sign : str
+        Separator sign for columns in csv files. The default is ';'.
+
+    Returns
+    -------
+    path : str
+        Path of written file.
+
+    """
+    if filetype == 'xlsx':
+        df.to_excel(path, index=False)
+
+    elif filetype == 'csv':
+        df.to_csv(path, sep=sep_sign, index=False)
+
+    elif filetype == 'parquet':
+        df.to_parquet(path, index=False)
+
+    # Feather requires a default index
+    elif filetype == 'feather':
+        df.reset_index(drop=True).to_feather(path)
+
+    else:
+        raise ValueError(f'Unsupported filetype: {filetype}')
+
+    return path
 
-"""Add in more advanced folder check. It should be able to deal with
-an incomplete set of folders and then create those which are missing"""
 
 def batch_exporter(df, year_col: str = None, export_path: str = None,
-                   prefix: str = None):
+                   prefix: str = None, filetype: str = 'xlsx',
+                   n_workers: int = 1, executor: str = 'thread',
+                   sep_sign: str = ';', layout: str = 'folder'):
     """
     Reads in dataframe, identifies year column and exports data to a set of
-    folders that equal the amount of years in the dataframe. If these folders
-    do not exist they will be created. 
+    folders that equal the amount of years in the dataframe. Folders that
+    do not exist are created, existing folders are left as they are.
 
     Data is then exported to each folder based on which year it belongs to.
+    The dataframe is split by year in a single groupby pass, and years can
+    be written in parallel by setting n_workers > 1.
+
+    Two folder layouts are supported:
+        'folder' = export_path/2021/prefix_2021.xlsx
+        'hive'   = export_path/prefix/aar=2021/part-0.parquet
+    In the hive layout the year column is stored in the folder name only,
+    as in other partitioned datasets (pyarrow, Spark), and each dataset gets
+    its own folder named by prefix, so several datasets can be exported to
+    the same export_path. Such datasets are read back from
+    export_path/prefix by FolderSearcher + DataImporter, or by
+    read_partitioned_dataset in import_helpers, which both skip folders
+    outside the requested years without opening any files.
 
     Parameters
     ----------
@@ -28,29 +84,84 @@ def batch_exporter(df, year_col: str = None, export_path: str = None,
     year_col : str
         Column indicating years in dataset. The default is None.
     export_path : str
-        Path to subfolders in which data will be exported to. 
+        Path to subfolders in which data will be exported to.
         The default is None.
     prefix : str
-        Prefix in name of dataset. The default is None.
+        Prefix in name of dataset. In the hive layout it is the name of the
+        dataset folder, and is required. The default is None.
+    filetype : str
+        'xlsx', 'csv', 'parquet' or 'feather'. xlsx is by far the slowest
+        to write. The default is 'xlsx'.
+    n_workers : int
+        Number of years to write at the same time. The default is 1.
+    executor : str
+        Pool used when n_workers > 1, 'thread' or 'process'.
+        The default is 'thread'.
+    sep_sign : str
+        Separator sign for columns in csv files. The default is ';'.
+    layout : str
+        'folder' or 'hive'. The default is 'folder'.
+
+    Raises
+    ------
+    ValueError
+        Invalid filetype, executor or layout input, or no prefix given
+        with the hive layout.
 
     Returns
     -------
     None.
 
     """
-    # Yields True if any subfolder already exists, then wont create folders
-    if all(
-        # path exists yields boolean
-        [os.path.exists(f'{export_path}/{year}')
-         for year in df[year_col].unique()]
-    ) is False:
-        # Make folders for unique years present
-        [os.makedirs(f'{export_path}/{year}') for year in df[year_col].unique()]
+    allowed_filetypes = ['xlsx', 'csv', 'parquet', 'feather']
+    allowed_executors = {'thread': ThreadPoolExecutor,
+                         'process': ProcessPoolExecutor}
+
+    if filetype not in allowed_filetypes:
+        raise ValueError(f'Filetype specified not allowed. Allowed filetypes: {allowed_filetypes}')
+
+    if executor not in allowed_executors:
+        raise ValueError(f'Invalid executor. Allowed executors: {list(allowed_executors)}')
+
+    if layout not in ['folder', 'hive']:
+        raise ValueError("Invalid layout. Allowed layouts: ['folder', 'hive']")
+
+    # Without a dataset folder, datasets exported to the same path would
+    # overwrite each other
+    if layout == 'hive' and not prefix:
+        raise ValueError('prefix must be given with the hive layout')
+
+    # Split data by year in one pass, on form (year, subset)
+    partitions = list(df.groupby(year_col, sort=False))
+
+    if layout == 'hive':
+        # Year is kept in folder name only
+        partitions = [(year, subset.drop(columns=year_col))
+                      for year, subset in partitions]
+        folders = [f'{export_path}/{prefix}/{year_col}={year}' for year, _ in partitions]
+        paths = [f'{folder}/part-0.{filetype}' for folder in folders]
+
+    else:
+        folders = [f'{export_path}/{year}' for year, _ in partitions]
+        paths = [f'{folder}/{prefix}_{year}.{filetype}'
+                 for folder, (year, _) in zip(folders, partitions)]
+
+    # Make folders for years that do not have one already
+    for folder in folders:
+        os.makedirs(folder, exist_ok=True)
 
     # Export data for unique years present
-    [(df.loc[df[year_col] == year]
-        .to_excel(f'{export_path}/{year}/{prefix}_{year}.xlsx', index=False))
-        for year in df[year_col].unique()
-            ]
-    
-    return
\ No newline at end of file
+    if n_workers <= 1:
+        for (year, subset), path in zip(partitions, paths):
+            write_file(subset, path, filetype=filetype, sep_sign=sep_sign)
+
+    else:
+        with allowed_executors[executor](max_workers=n_workers) as pool:
+            futures = [pool.submit(write_file, subset, path,
+                                   filetype=filetype, sep_sign=sep_sign)
+                       for (year, subset), path in zip(partitions, paths)]
+
+            # Raises first error encountered, if any
+            [future.result() for future in futures]
+
+    return
@@ -0,0 +1,222 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Mon Oct 12 09:41:07 2026
+
+@author: Benedikt Goodman
+@email: benedikt.goodman@ssb.no
+"""
+
+import os
+import json
+import time
+import inspect
+import hashlib
+import functools
+import pandas as pd
+
+
+class ImportCache():
+    """
+    Persistent on-disk cache for imported dataframes.
+
+    Each dataframe is stored as a parquet file in cache_dir. Files are looked
+    up by a fingerprint of the source file made from its path, size,
+    modification time and the options used to read it. If the source file
+    changes, the fingerprint changes and the file is parsed again.
+
+    When the total size of the cache exceeds max_size_mb, the least recently
+    used entries are removed until the cache is below the limit again.
+
+    Access times of cache hits are only updated in memory, and written to
+    the index on the next put, evict or flush, so reading from the cache
+    does not write to disk.
+    """
+
+    index_filename = 'cache_index.json'
+
+    def __init__(self, cache_dir: str, max_size_mb: float = 2048):
+        """
+        Parameters
+        ----------
+        cache_dir : str
+            Directory to store cached dataframes in. Created if it does not
+            exist.
+        max_size_mb : float
+            Maximum total size of cached files in megabytes.
+            The default is 2048.
+        """
+        if max_size_mb <= 0:
+            raise ValueError('max_size_mb must be larger than 0')
+
+        self.cache_dir = str(cache_dir)
+        self.max_size = int(max_size_mb * 1024**2)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        self.index = self.__read_index()
+        self.dirty = False
+
+        # Size limit may be lower than in previous runs
+        self.evict()
+
+    def __index_path(self):
+        return os.path.join(self.cache_dir, self.index_filename)
+
+    def __entry_path(self, key: str):
+        return os.path.join(self.cache_dir, f'{key}.parquet')
+
+    def __read_index(self):
+        """Reads index of cached entries, drops entries with missing files"""
+        try:
+            with open(self.__index_path(), 'r') as file:
+                index = json.load(file)
+
+        # Starts with empty index if index is missing or unreadable
+        except (FileNotFoundError, json.JSONDecodeError):
+            index = {}
+
+        return {key: entry for key, entry in index.items()
+                if os.path.exists(self.__entry_path(key))}
+
+    def __write_index(self):
+        with open(self.__index_path(), 'w') as file:
+            json.dump(self.index, file)
+
+        self.dirty = False
+
+    def flush(self):
+        """Writes access times updated by get to the index, if any"""
+        if self.dirty:
+            self.__write_index()
+
+        return self
+
+    @staticmethod
+    def describe_option(value):
+        """
+        Describes a read option so that it is the same across sessions.
+        repr of a function contains its memory address, so functions (e.g.
+        row_filter) are described by module, name, source code and the
+        values they refer to from enclosing scopes instead.
+        """
+        if isinstance(value, functools.partial):
+            return ('partial', ImportCache.describe_option(value.func),
+                    [ImportCache.describe_option(arg) for arg in value.args],
+                    sorted((k, ImportCache.describe_option(v))
+                           for k, v in value.keywords.items()))
+
+        if callable(value):
+            try:
+                source = inspect.getsource(value)
+            except (OSError, TypeError):
+                code = getattr(value, '__code__', None)
+                source = code.co_code.hex() if code is not None else None
+
+            closure = [ImportCache.describe_option(cell.cell_contents)
+                       for cell in getattr(value, '__closure__', None) or []]
+
+            return (getattr(value, '__module__', None),
+                    getattr(value, '__qualname__', type(value).__qualname__),
+                    source, closure)
+
+        return repr(value)
+
+    @staticmethod
+    def make_key(path: str, **read_options):
+        """
+        Makes cache key from path, size and modification time of a file
+        together with the options used to read it, see describe_option.
+
+        Returns None if the file cannot be found, in which case it should
+        not be cached.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        fingerprint = [os.path.abspath(path),
+                       stat.st_size,
+                       stat.st_mtime_ns,
+                       sorted((k, ImportCache.describe_option(v))
+                              for k, v in read_options.items())]
+
+        return hashlib.sha1(repr(fingerprint).encode()).hexdigest()
+
+    def get(self, key: str):
+        """Returns cached dataframe for key, or None if key is not cached."""
+        if key is None or key not in self.index:
+            return None
+
+        try:
+            df = pd.read_parquet(self.__entry_path(key))
+
+        # Entry removed or damaged outside of cache, treat as a miss
+        except (OSError, ValueError):
+            self.index.pop(key, None)
+            self.__write_index()
+            return None
+
+        # Mark entry as recently used, written to index by flush
+        self.index[key]['last_access'] = time.time()
+        self.dirty = True
+
+        return df
+
+    def put(self, key: str, df: 'pd.DataFrame'):
+        """Stores dataframe under key, then evicts old entries if needed."""
+        if key is None:
+            return
+
+        entry_path = self.__entry_path(key)
+
+        try:
+            df.to_parquet(entry_path)
+
+        # Some frames cannot be stored as parquet (mixed type columns etc.),
+        # these are simply not cached
+        except (ValueError, TypeError, ImportError) as error:
+            print(f'Warning: Dataframe could not be cached: {error}')
+            if os.path.exists(entry_path):
+                os.remove(entry_path)
+            return
+
+        self.index[key] = {'size': os.path.getsize(entry_path),
+                           'last_access': time.time()}
+
+        self.evict()
+
+    def evict(self):
+        """Removes least recently used entries until cache is within size limit"""
+        total_size = sum(entry['size'] for entry in self.index.values())
+
+        lru_order = sorted(self.index,
+                           key=lambda key: self.index[key]['last_access'])
+
+        for key in lru_order:
+            if total_size <= self.max_size:
+                break
+
+            total_size -= self.index.pop(key)['size']
+
+            if os.path.exists(self.__entry_path(key)):
+                os.remove(self.__entry_path(key))
+
+        self.__write_index()
+
+        return self
+
+    def clear(self):
+        """Removes all cached entries"""
+        for key in list(self.index):
+            if os.path.exists(self.__entry_path(key)):
+                os.remove(self.__entry_path(key))
+
+        self.index = {}
+        self.__write_index()
+
+        return self
+
+    def size_mb(self):
+        """Total size of cached files in megabytes"""
+        return sum(entry['size'] for entry in self.index.values()) / 1024**2
@@ -8,7 +8,16 @@ Created on Wed Jan 25 10:53:37 2023
 
 import pandas as pd
 
-from src.functions.import_helpers import simple_importer
+from bisect import bisect_left
+from functools import partial
+from typing import Callable
+
+from src.functions.import_helpers import (simple_importer, optimise_dtypes,
+                                          DatasetHandle, LazyDatasetDict,
+                                          partition_value, year_column,
+                                          constant_column)
+from src.functions.import_cache import ImportCache
+from src.functions.dataframe_tools import SubsetCache
 from src.functions.logic_helpers import check_listinput
 
 from tqdm import tqdm
@@ -22,6 +31,9 @@ class DataImporter():
         self.metadata = metadata_df
         self.import_func = import_func
         self.dataset_list = dataset_list
+        self.lazy = False
+        self.indexes = None
+        self.year_col = None
 
     def simple_import(self,
                       path_col: str = 'path',
@@ -29,49 +41,153 @@ class DataImporter():
                       dir_col: str = 'directory',
                       filetype: str = None,
                       sep_sign: str = ';',
-                      encode: str = 'iso-8859-1'):
+                      encode: str = 'iso-8859-1',
+                      usecols: list = None,
+                      dtype: dict = None,
+                      chunksize: int = None,
+                      row_filter: Callable = None,
+                      filters: list = None,
+                      use_threads: bool = True,
+                      n_workers: int = 1,
+                      executor: str = 'thread',
+                      errors: str = 'raise',
+                      cache_dir: str = None,
+                      cache_max_size_mb: float = 2048,
+                      lazy: bool = False):
         """
         Import function based on simple_importer.
         Uses a dataframe containing path, parent directory
         and filename to import datasets within a set of subfolders
-        and return them in a nested dictionary."""
+        and return them in a nested dictionary.
+
+        usecols, dtype, chunksize and row_filter are passed on to
+        simple_importer. Setting chunksize streams csv, txt and sas7bdat
+        files in chunks, keeping only columns in usecols and rows where
+        row_filter is True, so large files can be loaded within a fixed
+        memory budget.
+
+        For parquet files filters (e.g. [('aar', '>=', 2010)]) are pushed
+        down to the scan and use_threads decodes each file with multiple
+        threads.
+
+        n_workers sets how many files are read at the same time, executor
+        sets whether a 'thread' or 'process' pool is used for this. With
+        errors='report' files that fail to load are skipped and listed in
+        self.import_report instead of stopping the import.
+
+        If cache_dir is given, parsed files are stored there as parquet and
+        unchanged files are loaded from it on later imports. The cache is
+        limited to cache_max_size_mb, least recently used files are removed
+        first.
+
+        With lazy=True no files are read here. folder_dict then holds
+        DatasetHandle objects, and each dataset made by categorise_data is
+        only read and concatenated when it is first used, e.g. by
+        subset_years or write_data('sorted_df'). Per-file dataframes are
+        released once they are concatenated.
+
+        A custom import_func given to the constructor is called with path_col,
+        file_col, dir_col, filetype, sep_sign and encode, plus any of the
+        other options that are changed from their defaults. It returns
+        folder_dict only, so self.import_report is then None."""
+
+        cache = None
+        if cache_dir is not None:
+            cache = ImportCache(cache_dir, max_size_mb=cache_max_size_mb)
+
+        read_options = dict(path_col = path_col,
+                            file_col = file_col,
+                            dir_col = dir_col,
+                            filetype = filetype,
+                            sep_sign = sep_sign,
+                            encode = encode)
+
+        extra_options = dict(usecols = usecols,
+                             dtype = dtype,
+                             chunksize = chunksize,
+                             row_filter = row_filter,
+                             filters = filters,
+                             use_threads = use_threads,
+                             n_workers = n_workers,
+                             executor = executor,
+                             errors = errors,
+                             cache = cache,
+                             lazy = lazy)
+
+        if self.import_func is simple_importer:
+            read_options.update(extra_options, return_report=True)
+
+        # Custom import functions only get the options they were written
+        # for, plus any extra option that is changed from its default
+        else:
+            defaults = dict(usecols=None, dtype=None, chunksize=None,
+                            row_filter=None, filters=None, use_threads=True,
+                            n_workers=1, executor='thread', errors='raise',
+                            cache=None, lazy=False)
+            read_options.update({key: value for key, value in extra_options.items()
+                                 if value is not defaults[key]
+                                 and value != defaults[key]})
 
         bar = tqdm(range(1), desc='Data load progress')
         # Timing loop with progress bar
         for n in bar:
-            self.folder_dict = self.import_func(self.metadata,
-                                                path_col = path_col, 
-                                                file_col = file_col,
-                                                dir_col = dir_col,
-                                                filetype = filetype,
-                                                sep_sign = sep_sign,
-                                                encode = encode)
+            output = self.import_func(self.metadata, **read_options)
+
+        # Only simple_importer returns a report
+        if self.import_func is simple_importer:
+            self.folder_dict, self.import_report = output
+        else:
+            self.folder_dict, self.import_report = output, None
+
+        self.lazy = lazy
+
+        if self.import_report is None:
+            return self
+
+        # In lazy mode the cache is only used when files are loaded
+        if cache is not None and lazy is False:
+            print(f"Import cache: {self.import_report['cache_hits']} hit(s), "
+                  f"{self.import_report['cache_misses']} miss(es)")
+
+        # Alerts user of files that could not be imported
+        if len(self.import_report['errors']) > 0:
+            print(f"Warning: {len(self.import_report['errors'])} file(s) could not be imported:")
+            for path, error in self.import_report['errors'].items():
+                print(f'    {path}: {error}')
 
         return self
 
 
 
-    def add_years(self):
-        """Method adds years to every dataframe in nested dictionary.
-        Infers year to add based on folder names from input data."""
+    def add_years(self, year_col: str = 'aar_added'):
+        """
+        Adds years to every dataset, inferred from the folder names of the
+        input data. Folders named on the form aar=2021 (see batch_exporter
+        with layout='hive') give the year after '='.
 
-        # Create local copy of dictionary with all data
-        df_dict = self.folder_dict
+        The year column is not written into each imported dataframe. It is
+        added once per category when categorise_data concatenates the
+        dataframes, as int16 (or category if folder names are not numeric).
+        write_data(output_object='folder_dict') adds it in place to the
+        imported dataframes, once, without copying them.
 
-        # Make list from keys, check if they are numeric, if test fails
-        # Print error message
-        """should change to throw the exact error you want tbf..."""
-        # if self.use_numeric_folders is False:
-        #     return self
+        Parameters
+        ----------
+        year_col : str
+            Name of year column. The default is 'aar_added'.
 
-        # else:
-        try:
-            key_list = pd.Series(list(df_dict.keys())) # Will fail if folders contain non-numeric data
+        Returns
+        -------
+        self
+            The method returns self so it can be chained.
+        """
+        non_numeric = [folder for folder in self.folder_dict
+                       if not partition_value(folder).isnumeric()]
 
-        except ValueError:
-            error_message = """
-Error: Sub-directory names containing raw data cannot be interpeted as numbers.
-Rename folders in main directory to yearly format.
+        if len(non_numeric) > 0:
+            error_message = f"""
+Warning: Sub-directory names {non_numeric} containing raw data cannot be interpeted as numbers.
+Years for these are stored as text.
 Hint:
     Subfoldername 1 = 2021
     Subfoldername 2 = 2022
@@ -79,28 +195,15 @@ Hint:
             """
             print(error_message)
 
-        # Loop below adds years to all dataframes in the entire dict
-        """Adds aar column with year equal to sub-folder name"""
-        for year in df_dict.keys():
-            # Creates a temp dict based on year inferred from keys in dictionary
-            temp_dict = df_dict[year].copy()
-
-            # Iterates through each dict, adds year column based on inferred year
-            for dataframe in temp_dict.keys():
-                temp_dict[dataframe]['aar_added'] = year
-
-            # Add temp_df to output dict
-            df_dict[year] = temp_dict
-
-        # Overwrite local variable
-        self.folder_dict = df_dict
+        self.year_col = year_col
 
         return self
 
-
     def categorise_data(self, 
                     sort_by='aar_added',
                     dataset_list = None,
+                    stable_sort = True,
+                    index_cols = None,
                     ):
         """
         Reorganise nested dictionary containing data according to name of 
@@ -110,13 +213,25 @@ Hint:
         matching the keyword in keyword_list,extracts them and concatenates 
         them to a single dataframe for each category.
 
+        Filenames are looked up in a sorted index, so each keyword is matched
+        with a binary search instead of a scan of every file in every folder.
+        Matching dataframes are concatenated once per category, in the order
+        of folders and files in the imported data.
+
         Parameters
         ----------
         sort_by : str
             Dataframe column to sort values in resulting dataframes by.
-            The default is 'aar_added'.
+            None skips sorting. The default is 'aar_added'.
         dataset_list : list
             List of keywords to categorise datasets in output dictionary.
+            The default is None, which uses dataset_list given to the class.
+        stable_sort : bool
+            If True, rows with equal values in sort_by keep the order of
+            folders and files. The default is True.
+        index_cols : list
+            Columns to index for select, see build_indexes. None builds no
+            indexes up front. The default is None.
 
         Returns
         -------
@@ -125,6 +240,9 @@ Hint:
             dataset_list.
 
         """
+        if dataset_list is None:
+            dataset_list = self.dataset_list
+
         # Progress bar
         bar = tqdm(range(1), desc='Sorting data by category of dataset')
 
@@ -133,43 +251,93 @@ Hint:
             # This sucker contains the data you want to reorganise
             folder_dict = self.folder_dict
 
+            # Index of all files sorted by filename, positions of folder and
+            # file are kept to restore the original order after lookup
+            file_index = sorted(
+                (filename, folder_pos, file_pos, folder)
+                for folder_pos, (folder, files) in enumerate(folder_dict.items())
+                for file_pos, filename in enumerate(files))
+
+            filenames = [item[0] for item in file_index]
+
             # For storage of concatenated dataframes
             storage_dict = {}
 
             for kw_list_item in dataset_list:
 
-                # Emtpy list to store extracted dataframes in
-                df_list = []
+                # Range of filenames starting with keyword
+                start = bisect_left(filenames, kw_list_item)
+                stop = bisect_left(filenames, kw_list_item + '\U0010ffff')
 
-                for key, val in folder_dict.items():
+                matches = sorted(file_index[start:stop],
+                                 key=lambda item: (item[1], item[2]))
 
-                    """Extracts folder_dict[key] if it matches the start of item in
-                    dataset_list. Returns empty dictionary if not -> hence usage of
-                    if conditions below."""
-                    rearanged_dict = {k: v 
-                                    for k, v in folder_dict[key].items() 
-                                    if k.startswith(kw_list_item)}
+                if len(matches) == 0:
+                    continue
 
-                    # Catches dicts with content and concatenates to dataframe
-                    if len(rearanged_dict) > 0:
-                        df = pd.concat(rearanged_dict)
-                        df_list.append(df)
+                storage_dict[kw_list_item] = partial(
+                    self.__concat_category,
+                    [folder_dict[folder][filename] for filename, _, _, folder in matches],
+                    [filename for filename, _, _, _ in matches],
+                    years=[folder for _, _, _, folder in matches] if self.year_col else None,
+                    year_col=self.year_col,
+                    sort_by=sort_by,
+                    stable_sort=stable_sort)
 
-                        # Concats list of matching dataframes into one dataframe
-                        df_with_filtered_keys = (
-                            pd.concat(df_list)
-                            .reset_index(level=0)
-                            .rename(columns={'level_0': 'filename'})
-                            .sort_values('aar_added'))
+            if len(storage_dict) == 0:
+                raise AssertionError('No categories matching imported data found in dataset_list. Please revise dataset_list items.')
 
-                        storage_dict[kw_list_item] = df_with_filtered_keys
+            # In lazy mode categories are concatenated when first used
+            if self.lazy is True:
+                self.sorted_dataframes = LazyDatasetDict(storage_dict)
+            else:
+                self.sorted_dataframes = {key: concat()
+                                          for key, concat in storage_dict.items()}
 
-                    error_msg = 'No categories matching imported data found in dataset_list. Please revise dataset_list items.'
+        if index_cols is not None:
+            self.build_indexes(index_cols)
 
-                if len(storage_dict) == 0:
-                    raise AssertionError(error_msg)
+        return self
 
-            self.sorted_dataframes = storage_dict
+    @staticmethod
+    def __concat_category(frames: list, filenames: list, years=None,
+                          year_col=None, sort_by=None, stable_sort=True):
+        """Concatenates dataframes (or DatasetHandles, which are loaded)
+        for one category into a single dataframe with a filename column,
+        and a year column from the folder of each dataframe if years are
+        given"""
+        caches = {id(frame.cache): frame.cache for frame in frames
+                  if isinstance(frame, DatasetHandle) and frame.cache is not None}
+
+        frames = [frame.load() if isinstance(frame, DatasetHandle) else frame
+                  for frame in frames]
+
+        # Access times of cache hits written once per category
+        for cache in caches.values():
+            cache.flush()
+
+        df = (
+            pd.concat(frames, keys=filenames)
+            .reset_index(level=0)
+            .rename(columns={'level_0': 'filename'}))
+
+        if years is not None:
+            df[year_col] = year_column(years, [len(frame) for frame in frames])
+
+        if sort_by is not None:
+            df = df.sort_values(sort_by,
+                                kind='stable' if stable_sort else 'quicksort')
+
+        return df
+
+    def __apply_to_datasets(self, func):
+        """Applies func(name, df) to every dataset in sorted_dataframes.
+        Datasets not yet loaded in lazy mode stay unloaded."""
+        if isinstance(self.sorted_dataframes, LazyDatasetDict):
+            self.sorted_dataframes.apply(func)
+        else:
+            self.sorted_dataframes = {name: func(name, df) for name, df
+                                      in self.sorted_dataframes.items()}
 
         return self
 
@@ -206,28 +374,23 @@ Hint:
             Dictionary containing dataframes as keys. Dual vars have been eliminated
 
         """
-        storage_dict = self.sorted_dataframes
-
-        for df in storage_dict.keys():
-            column_names = storage_dict[df].columns
+        def tidy(name, df):
+            column_names = df.columns
 
             # Prompts warning
             if dupl_col1 and dupl_col2 not in column_names:
-                print(f'Warning: Specified duplicate columns not found in {df}')
-                pass
+                print(f'Warning: Specified duplicate columns not found in {name}')
+                return df
 
             # Renames dupl_col2
             elif dupl_col1 not in column_names:
-                storage_dict[df] = storage_dict[df].rename(
-                    columns={dupl_col2 : dupl_col1})
+                return df.rename(columns={dupl_col2 : dupl_col1})
 
             # Drops dupl_col2 if dupl_col1 is present
             else:
-                storage_dict[df] = storage_dict[df].drop(dupl_col2, axis=1)
-
-        self.sorted_dataframes = storage_dict
+                return df.drop(dupl_col2, axis=1)
 
-        return self
+        return self.__apply_to_datasets(tidy)
 
     def sort_df(self, sort_by: 'list or str' = None):
         """
@@ -247,36 +410,177 @@ Hint:
         sorted_dataframes : dict
             Writes dictionary to class memory.
         """
-        # Extract subset where columns sortedby are not present
-        _exempt_dfs = {
-            key: df for key, df in self.sorted_dataframes.items()
-            if not all(item in df.columns for item in sort_by)
-        }
-        # Dfs where columns sorted by are present
-        _sorted_dfs = {
-            # Sorts dataframes in dict by values
-            key: df.sort_values(sort_by) for key, df 
-            in self.sorted_dataframes.items() 
-
-            # Checks if all items in sort_by are present in df columns
-            if all(item in df.columns for item in sort_by)
-        }
-
-        # Add extempt to sorted
-        _sorted_dfs.update(_exempt_dfs)
-        
-        if self.sorted_dataframes.keys() == _sorted_dfs.keys() is False:
-            msg = [
-                'Warning!',
-                'sort_df method accidentally removed some dataframes.',
-                'The following dataframes were eliminated:']
-            print(' '.join(msg))
-            [key for key in _sorted_dfs if key not in self.sorted_dataframes.keys()]
-        
-        self.sorted_dataframes = _sorted_dfs
+        if isinstance(sort_by, str):
+            sort_by = [sort_by]
+
+        def sort(name, df):
+            # Only sorts if all items in sort_by are present in df columns
+            if all(item in df.columns for item in sort_by):
+                return df.sort_values(sort_by)
+
+            return df
+
+        return self.__apply_to_datasets(sort)
+
+    def optimise_dtypes(self,
+                        year_cols: list = None,
+                        category_ratio: float = 0.5,
+                        downcast_floats: bool = False,
+                        output_object: str = 'sorted_df'):
+        """
+        Reduces memory use of imported data by converting low-cardinality
+        string columns to category, parsing year columns to int16 and
+        downcasting numeric columns. See optimise_dtypes in import_helpers
+        for details.
+
+        Memory use before and after per dataset is printed and stored in
+        self.memory_report.
+
+        Parameters
+        ----------
+        year_cols : list
+            Columns containing years. The default is None, which means
+            ['aar', 'aar_added'].
+        category_ratio : float
+            String columns with unique values / rows below this ratio are
+            turned into category. The default is 0.5.
+        downcast_floats : bool
+            Downcast float64 columns to float32. The default is False.
+        output_object : str
+            'sorted_df' optimises dataframes made by categorise_data,
+            'folder_dict' optimises imported dataframes per file.
+            The default is 'sorted_df'.
+
+        Returns
+        -------
+        self
+            The method returns self so it can be chained.
+        """
+        if output_object == 'sorted_df':
+            datasets = self.sorted_dataframes
+        elif output_object == 'folder_dict':
+            # Flattens nested dictionary to {(folder, filename) : df},
+            # loading files first in lazy mode
+            datasets = {(folder, filename): df.load() if isinstance(df, DatasetHandle) else df
+                        for folder, files in self.folder_dict.items()
+                        for filename, df in files.items()}
+        else:
+            raise ValueError("Invalid output_object input. Valid inputs are 'sorted_df' and 'folder_dict'.")
+
+        report = []
+
+        for name, df in datasets.items():
+            mb_before = df.memory_usage(deep=True).sum() / 1024**2
+
+            datasets[name] = optimise_dtypes(df,
+                                             year_cols=year_cols,
+                                             category_ratio=category_ratio,
+                                             downcast_floats=downcast_floats)
+
+            mb_after = datasets[name].memory_usage(deep=True).sum() / 1024**2
+            report.append(['/'.join(name) if isinstance(name, tuple) else name,
+                           mb_before, mb_after])
+
+        if output_object == 'folder_dict':
+            for (folder, filename), df in datasets.items():
+                self.folder_dict[folder][filename] = df
+
+        self.memory_report = pd.DataFrame(report, columns=['dataset', 'mb_before', 'mb_after'])
+        self.memory_report['mb_saved'] = self.memory_report['mb_before'] - self.memory_report['mb_after']
+
+        print(self.memory_report.round(2).to_string(index=False))
 
         return self
 
+    def build_indexes(self, index_cols: list = None,
+                      dataset_names: list = None):
+        """
+        Indexes row positions by value of index_cols in sorted_dataframes,
+        used by select. Datasets without a column are not indexed on it.
+
+        Indexes are kept up to date by select: if a dataset has been replaced
+        since it was indexed (by sort_df, subset_years etc.) it is indexed
+        again when next selected from. In lazy mode only datasets already
+        loaded are indexed up front.
+
+        Parameters
+        ----------
+        index_cols : list
+            Columns to index. The default is None, which means ['aar',
+            'produktkode', 'naaringskode'].
+        dataset_names : list
+            Datasets to index. The default is None, which means all.
+
+        Returns
+        -------
+        self
+            The method returns self so it can be chained.
+        """
+        if index_cols is None:
+            index_cols = ['aar', 'produktkode', 'naaringskode']
+
+        elif isinstance(index_cols, str):
+            index_cols = [index_cols]
+
+        self.indexes = SubsetCache(self.sorted_dataframes)
+
+        if dataset_names is None:
+            dataset_names = list(self.sorted_dataframes)
+
+        for name in dataset_names:
+            if (isinstance(self.sorted_dataframes, LazyDatasetDict)
+                    and not self.sorted_dataframes.is_loaded(name)):
+                continue
+
+            for col in index_cols:
+                if col in self.sorted_dataframes[name].columns:
+                    self.indexes.index(name, col)
+
+        return self
+
+    def select(self, name: str, **criteria):
+        """
+        Selects rows of a dataset in sorted_dataframes by values of columns,
+        looked up in indexes instead of scanning the dataset.
+
+        Syntax:
+            importer.select('forbruk', aar=2021, produktkode=['A', 'B'])
+
+        Values are compared as they are, so they must match the dtype of the
+        column. A list of values selects rows equal to any of them. Columns
+        not indexed by build_indexes are indexed on first use.
+
+        Parameters
+        ----------
+        name : str
+            Name of dataset in sorted_dataframes.
+        **criteria : kwargs
+            Columns and values to select rows by.
+
+        Raises
+        ------
+        ValueError
+            Column in criteria not found in dataset.
+
+        Returns
+        -------
+        subset : pd.DataFrame
+            Selected rows, in the order of the dataset.
+        """
+        if self.indexes is None:
+            self.indexes = SubsetCache(self.sorted_dataframes)
+
+        # sorted_dataframes may have been replaced by a new dict since the
+        # indexes were made, replaced datasets are indexed again
+        self.indexes.data = self.sorted_dataframes
+
+        missing = [col for col in criteria if col not in self.sorted_dataframes[name].columns]
+
+        if len(missing) > 0:
+            raise ValueError(f'Columns {missing} not found in {name}')
+
+        return self.indexes.subset(name, **criteria)
+
     # Should this maybe be generalised?
     def subset_years(self, df_name=None, year_col='aar', start_year=2010, stop_year=None):
         """Method for filtering out all years aside from desired year from energiregnskapet."""
@@ -284,8 +588,9 @@ Hint:
         if df_name is None:
             print('Please define which dataframe you want to subset. Hint: it is one of the names you defined in dataset_list.')
 
-        # Write dictionary with data as local variable
-        __subset_df = self.sorted_dataframes[df_name].copy(deep=True)
+        # Write dictionary with data as local variable, .loc below returns
+        # a copy so the full dataframe is not copied first
+        __subset_df = self.sorted_dataframes[df_name]
     
         # Subset dataframe with energiregnskapet to only contain data between 
         # start_year and last_year
@@ -302,11 +607,38 @@ Hint:
     
     # Output module
     def write_data(self, output_object: str = 'folder_dict'):
-        """Write dictionary inside object memory as variable"""
+        """Write dictionary inside object memory as variable. With
+        'folder_dict' the year column from add_years is added in place to
+        the imported dataframes, which are returned without copying."""
 
         if output_object == 'folder_dict':
+            if self.year_col is None:
+                return self.folder_dict
+
+            # Year column from add_years, added in place so dataframes are
+            # not copied. Handles in lazy mode add it when loaded. Same dtype
+            # as year_column gives in categorise_data: int16, or category if
+            # folder names are not numeric.
+            values = [partition_value(folder) for folder in self.folder_dict]
+            numeric = all(value.isnumeric() for value in values)
+            dtype = 'int16' if numeric else pd.CategoricalDtype(pd.unique(values))
+
+            for value, files in zip(values, self.folder_dict.values()):
+                value = int(value) if numeric else value
+
+                for df in files.values():
+                    if isinstance(df, DatasetHandle):
+                        if self.year_col not in df.added_columns:
+                            df.add_column(self.year_col, value, dtype=dtype)
+
+                    elif self.year_col not in df.columns:
+                        df[self.year_col] = constant_column(value, len(df), dtype)
+
             return self.folder_dict
         if output_object == 'sorted_df':
+            # Makes any datasets not yet loaded in lazy mode
+            if isinstance(self.sorted_dataframes, LazyDatasetDict):
+                return self.sorted_dataframes.materialise()
             return self.sorted_dataframes
         else:
             print('Invalid input. Write folder_dict for datasets organised by subfolder or sorted_df for datasets sorted by keywords.')
\ No newline at end of file
@@ -7,13 +7,23 @@ Created on Dec 01 10:34:18 2022
 """
 
 import os
+import pickle
 import pandas as pd
 import numpy as np
 from pathlib import Path
+from collections import defaultdict
+from collections.abc import MutableMapping
+from contextlib import nullcontext
+from functools import partial
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
 # Import type hints
 from typing import List, Callable
 
+from src.functions.import_cache import ImportCache
+
 def check_files(path: str) -> list:
     """Checks if files found at path are files. If they are the function yields
     filenames as list of pathlib path objects"""
@@ -74,13 +84,726 @@ def file_finder(folder_path: str,
         return filtered_files
 
 
+def scan_file_index(root: str, max_depth: int = None) -> 'pd.DataFrame':
+    """
+    Recursively scans root with os.scandir and returns an index of all files
+    found.
+
+    Directory entries carry their file type, so only files need a stat call
+    (for size and modification time). Subfolders deeper than max_depth are
+    not scanned.
+
+    Parameters
+    ----------
+    root : str
+        Directory to scan.
+    max_depth : int
+        Depth of subfolders to scan. 0 only scans files in root, 1 also scans
+        files in subfolders of root etc. The default is None (no limit).
+
+    Raises
+    ------
+    ValueError
+        root does not exist.
+
+    Returns
+    -------
+    file_index : pd.DataFrame
+        Dataframe with columns name, directory (name of parent folder),
+        dir_path (path of parent folder), path, size (bytes) and mtime
+        (seconds since epoch). Sorted by dir_path and name.
+
+    """
+    if os.path.isdir(root) is False:
+        raise ValueError('Input path does not exist.')
+
+    rows = []
+
+    # Stack of (directory, depth) to scan
+    stack = [(str(root).rstrip('/'), 0)]
+
+    while len(stack) > 0:
+        directory, depth = stack.pop()
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file():
+                    stat = entry.stat()
+                    rows.append((entry.name, os.path.basename(directory),
+                                 directory, f'{directory}/{entry.name}',
+                                 stat.st_size, stat.st_mtime))
+
+                elif entry.is_dir() and (max_depth is None or depth < max_depth):
+                    stack.append((f'{directory}/{entry.name}', depth + 1))
+
+    file_index = pd.DataFrame(rows, columns=['name', 'directory', 'dir_path',
+                                             'path', 'size', 'mtime'])
+
+    return file_index.sort_values(['dir_path', 'name'], ignore_index=True)
+
+
+def directory_mtimes(root: str, max_depth: int = None) -> dict:
+    """Returns modification time of root and every subfolder down to
+    max_depth. Used to check if a saved file index is still valid, as adding,
+    removing or renaming files changes the modification time of the folder."""
+    mtimes = {}
+    stack = [(str(root).rstrip('/'), 0)]
+
+    while len(stack) > 0:
+        directory, depth = stack.pop()
+        mtimes[directory] = os.stat(directory).st_mtime_ns
+
+        if max_depth is None or depth < max_depth:
+            with os.scandir(directory) as entries:
+                stack.extend((f'{directory}/{entry.name}', depth + 1)
+                             for entry in entries if entry.is_dir())
+
+    return mtimes
+
+
+def load_file_index(root: str,
+                    max_depth: int = None,
+                    cache_path: str = None) -> 'pd.DataFrame':
+    """
+    Returns file index of root made by scan_file_index. If cache_path is
+    given, the index is saved there and reused on later calls for as long as
+    no folder under root has changed.
+
+    Parameters
+    ----------
+    root : str
+        Directory to scan.
+    max_depth : int
+        Depth of subfolders to scan. The default is None (no limit).
+    cache_path : str
+        Path of file to save index to. The default is None (no caching).
+
+    Returns
+    -------
+    file_index : pd.DataFrame
+        See scan_file_index.
+
+    """
+    if cache_path is None:
+        return scan_file_index(root, max_depth=max_depth)
+
+    if os.path.isdir(root) is False:
+        raise ValueError('Input path does not exist.')
+
+    mtimes = directory_mtimes(root, max_depth=max_depth)
+
+    try:
+        cached = pd.read_pickle(cache_path)
+
+        if (cached['root'] == str(root) and cached['max_depth'] == max_depth
+                and cached['dir_mtimes'] == mtimes):
+            return cached['file_index']
+
+    # Missing or unreadable cache, index is rebuilt
+    except (OSError, KeyError, TypeError, ValueError, EOFError,
+            pickle.UnpicklingError):
+        pass
+
+    file_index = scan_file_index(root, max_depth=max_depth)
+
+    pd.to_pickle({'root': str(root), 'max_depth': max_depth,
+                  'dir_mtimes': mtimes, 'file_index': file_index},
+                 cache_path)
+
+    return file_index
+
+
+def search_file_index(file_index: 'pd.DataFrame',
+                      filter_clauses: list[str] = None,
+                      dir_paths: list = None) -> 'pd.DataFrame':
+    """
+    Filters a file index made by scan_file_index on filename and parent
+    folder.
+
+    Works like file_finder, i.e. filenames are kept if they contain any of
+    filter_clauses, and all searches are done in lowercase. The search runs
+    once over the whole index instead of once per folder.
+
+    Parameters
+    ----------
+    file_index : pd.DataFrame
+        Index made by scan_file_index.
+    filter_clauses : list
+        Substrings to search for in filenames. The default is None (all files).
+    dir_paths : list
+        Paths of parent folders to keep. The default is None (all folders).
+
+    Returns
+    -------
+    file_index : pd.DataFrame
+        Subset of rows in file_index, ordered by folder in the order of
+        dir_paths and by lowercase filename within each folder.
+
+    """
+    mask = pd.Series(True, index=file_index.index)
+    names = file_index['name'].str.lower()
+
+    if filter_clauses is not None:
+        filter_clauses = [str(n).lower() for n in filter_clauses]
+        mask &= names.str.contains('|'.join(filter_clauses))
+
+    if dir_paths is not None:
+        dir_paths = [str(n).rstrip('/') for n in dir_paths]
+        mask &= file_index['dir_path'].isin(dir_paths)
+
+    result = file_index.loc[mask].assign(_name_lower=names[mask])
+
+    # Order folders as given, files alphabetically as in file_finder
+    if dir_paths is not None:
+        result['_dir_order'] = result['dir_path'].map(
+            {d: i for i, d in enumerate(dir_paths)})
+        result = result.sort_values(['_dir_order', '_name_lower'], kind='stable')
+    else:
+        result = result.sort_values(['dir_path', '_name_lower'], kind='stable')
+
+    return result.drop(columns=['_name_lower', '_dir_order'], errors='ignore')
+
+
+def check_columns_present(columns, required, path: str):
+    """Raises ValueError if any of required (lowercase) columns are missing"""
+    missing = [col for col in required if col not in columns]
+
+    if len(missing) > 0:
+        raise ValueError(f'Columns {missing} not found in {path}')
+
+
+def csv_read_kwargs(path: str,
+                    sep_sign: str = ';',
+                    encode: str = 'iso-8859-1',
+                    usecols: list = None,
+                    dtype: dict = None) -> dict:
+    """
+    Makes usecols and dtype arguments for pd.read_csv from lowercase column
+    names, so projection and dtypes are applied by the parser.
+
+    Only the header of the file is read to translate lowercase names to the
+    names used in the file. Columns not given in dtype are read as str.
+    """
+    header = pd.read_csv(path, encoding=encode, sep=sep_sign, nrows=0).columns
+    column_lookup = {col.lower(): col for col in header}
+
+    check_columns_present(column_lookup, (usecols or []) + list(dtype or {}), path)
+
+    read_kwargs = {'dtype': defaultdict(lambda: str)}
+
+    if usecols is not None:
+        read_kwargs['usecols'] = [column_lookup[col] for col in usecols]
+
+    if dtype is not None:
+        read_kwargs['dtype'].update(
+            {column_lookup[col]: val for col, val in dtype.items()})
+
+    return read_kwargs
+
+
+def read_file_chunked(path: str,
+                      filetype: str = None,
+                      sep_sign: str = ';',
+                      encode: str = 'iso-8859-1',
+                      chunksize: int = 100_000,
+                      usecols: list = None,
+                      dtype: dict = None,
+                      row_filter: Callable = None) -> 'pd.DataFrame':
+    """
+    Reads csv, txt or sas7bdat file in chunks of chunksize rows. Columns
+    are projected to usecols, converted to dtype and filtered by row_filter
+    one chunk at a time, so peak memory use is bounded by the chunk size and
+    the size of the data that is kept.
+
+    For csv and txt files usecols and dtype are applied by the parser itself,
+    so columns not in usecols are never loaded. Columns not given in dtype
+    are read as str, as in read_file.
+
+    Parameters
+    ----------
+    path : str
+        Path of file to import.
+    filetype : str
+        'csv', 'txt' or 'sas7bdat'.
+    sep_sign : str
+        Separator sign for columns in csv or txt files. The default is ';'.
+    encode : str
+        Encoding of source datafile. The default is 'iso-8859-1'.
+    chunksize : int
+        Number of rows per chunk. None reads the file as a single chunk.
+        The default is 100 000.
+    usecols : list
+        Lowercase names of columns to keep. The default is None (all columns).
+    dtype : dict
+        Lowercase column names as keys, datatypes as values.
+        The default is None.
+    row_filter : Callable
+        Function taking a chunk (with lowercase column names) and returning a
+        boolean mask of rows to keep. Must be defined at module level if files
+        are read in a process pool. The default is None.
+
+    Raises
+    ------
+    ValueError
+        Unsupported filetype or columns in usecols/dtype not found in file.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Imported data with lowercase column names.
+
+    """
+    if usecols is not None:
+        usecols = [str(col).lower() for col in usecols]
+
+    if dtype is not None:
+        dtype = {str(col).lower(): val for col, val in dtype.items()}
+
+    if filetype in ['csv', 'txt']:
+        read_kwargs = csv_read_kwargs(path, sep_sign=sep_sign, encode=encode,
+                                      usecols=usecols, dtype=dtype)
+
+        reader = pd.read_csv(path, encoding=encode, sep=sep_sign,
+                             chunksize=chunksize, **read_kwargs)
+
+    elif filetype == 'sas7bdat':
+        reader = pd.read_sas(path, encoding=encode, chunksize=chunksize)
+
+    else:
+        raise ValueError(f'Chunked reading not supported for filetype: {filetype}')
+
+    # Without chunksize the readers return the whole file as a dataframe
+    if chunksize is None:
+        reader = nullcontext([reader])
+
+    chunks = []
+
+    with reader as chunk_iterator:
+        for chunk in chunk_iterator:
+            chunk = chunk.rename(columns=lambda x: x.lower())
+
+            # sas7bdat reader cannot project columns, done per chunk instead
+            if filetype == 'sas7bdat':
+                check_columns_present(chunk.columns, (usecols or []) + list(dtype or {}), path)
+
+                if dtype is not None:
+                    chunk = chunk.astype(dtype)
+
+            # Also puts csv columns in usecols order
+            if usecols is not None:
+                chunk = chunk[usecols]
+
+            if row_filter is not None:
+                chunk = chunk.loc[row_filter(chunk)]
+
+            chunks.append(chunk)
+
+    # Empty files yield no chunks
+    if len(chunks) == 0:
+        return pd.DataFrame(columns=usecols)
+
+    return pd.concat(chunks, ignore_index=True)
+
+
+def read_parquet_dataset(path: str,
+                         usecols: list = None,
+                         filters: list = None,
+                         use_threads: bool = True) -> 'pd.DataFrame':
+    """
+    Reads a parquet file, or a folder of parquet files, through a pyarrow
+    dataset.
+
+    Only columns in usecols are decoded, and filters are pushed down to the
+    scan so row groups that cannot match are skipped using parquet
+    statistics. Decoding is spread across threads if use_threads is True.
+
+    Parameters
+    ----------
+    path : str
+        Path of parquet file or folder with parquet files.
+    usecols : list
+        Lowercase names of columns to keep. The default is None (all columns).
+    filters : list
+        Filters on the same form as pd.read_parquet, with lowercase column
+        names. I.e. [('aar', '>=', 2010)] or, for or-conditions, a list of
+        such lists. The default is None.
+    use_threads : bool
+        Decode columns and row groups in parallel. The default is True.
+
+    Raises
+    ------
+    ValueError
+        Columns in usecols or filters not found in data.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Imported data with lowercase column names.
+
+    """
+    dataset = ds.dataset(path, format='parquet', partitioning='hive')
+
+    # Translate lowercase names to names used in file
+    column_lookup = {name.lower(): name for name in dataset.schema.names}
+
+    columns = None
+    if usecols is not None:
+        usecols = [str(col).lower() for col in usecols]
+        check_columns_present(column_lookup, usecols, path)
+        columns = [column_lookup[col] for col in usecols]
+
+    expression = None
+    if filters is not None:
+        # Filters given as list of tuples are a single and-condition
+        if all(isinstance(item, tuple) for item in filters):
+            filters = [filters]
+
+        check_columns_present(column_lookup,
+                              [str(col).lower() for group in filters for col, _, _ in group],
+                              path)
+
+        filters = [[(column_lookup[str(col).lower()], op, val) for col, op, val in group]
+                   for group in filters]
+        expression = pq.filters_to_expression(filters)
+
+    table = dataset.to_table(columns=columns, filter=expression,
+                             use_threads=use_threads)
+
+    return (table.to_pandas(use_threads=use_threads)
+            .rename(columns=lambda x: x.lower()))
+
+
+def read_file(path: str,
+              filetype: str = None,
+              sep_sign: str = ';',
+              encode: str = 'iso-8859-1',
+              usecols: list = None,
+              dtype: dict = None,
+              chunksize: int = None,
+              row_filter: Callable = None,
+              filters: list = None,
+              use_threads: bool = True) -> 'pd.DataFrame':
+    """
+    Reads a single file into a dataframe and converts column names to
+    lowercase.
+
+    Defined at module level so it can be sent to both thread and process
+    pools by simple_importer.
+
+    If chunksize is given, csv, txt and sas7bdat files are streamed through
+    read_file_chunked. csv and txt files are also read by read_file_chunked
+    when usecols or dtype is given, so these are applied by the parser. In
+    all other cases usecols, dtype and row_filter are applied after the file
+    is read.
+
+    Parameters
+    ----------
+    path : str
+        Path of file to import.
+    filetype : str
+        Filetype of file to import. See simple_importer for allowed filetypes.
+    sep_sign : str
+        Separator sign for columns in csv or txt files. The default is ';'.
+    encode : str
+        Encoding of source datafile. The default is 'iso-8859-1'.
+    usecols : list
+        Lowercase names of columns to keep. The default is None (all columns).
+    dtype : dict
+        Lowercase column names as keys, datatypes as values.
+        The default is None.
+    chunksize : int
+        Number of rows per chunk for streamed reads of csv, txt and sas7bdat
+        files. The default is None (whole file read at once).
+    row_filter : Callable
+        Function taking a dataframe and returning a boolean mask of rows to
+        keep. The default is None.
+    filters : list
+        Filters pushed down to the scan of parquet files, see
+        read_parquet_dataset. The default is None.
+    use_threads : bool
+        Decode parquet files with multiple threads. The default is True.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Imported data with lowercase column names.
+
+    """
+    # csv and txt files always go through chunked reader when projecting, so
+    # that usecols and dtype are applied by the parser
+    streamed = ((chunksize is not None and filetype in ['csv', 'txt', 'sas7bdat'])
+                or (filetype in ['csv', 'txt'] and (usecols is not None or dtype is not None)))
+
+    if streamed:
+        return read_file_chunked(path, filetype=filetype, sep_sign=sep_sign,
+                                 encode=encode, chunksize=chunksize,
+                                 usecols=usecols, dtype=dtype,
+                                 row_filter=row_filter)
+
+    if filetype in ['csv', 'txt']:
+        df = pd.read_csv(path, encoding=encode, sep=sep_sign, dtype=str)
+
+    elif filetype == 'sas7bdat':
+        df = pd.read_sas(path, encoding=encode)
+
+    # read_excel does not take an encoding argument
+    elif filetype in ['xlsx', 'xls']:
+        df = pd.read_excel(path)
+
+    elif filetype == 'parquet':
+        df = read_parquet_dataset(path, usecols=usecols, filters=filters,
+                                  use_threads=use_threads)
+
+    else:
+        raise ValueError(f'Unsupported filetype: {filetype}')
+
+    df = df.rename(columns=lambda x: x.lower())
+
+    if usecols is not None:
+        usecols = [str(col).lower() for col in usecols]
+        check_columns_present(df.columns, usecols, path)
+        df = df[usecols]
+
+    if dtype is not None:
+        dtype = {str(col).lower(): val for col, val in dtype.items()}
+        check_columns_present(df.columns, list(dtype), path)
+        df = df.astype(dtype)
+
+    if row_filter is not None:
+        df = df.loc[row_filter(df)]
+
+    return df
+
+
+def read_files_parallel(paths: list,
+                        read_func: Callable = read_file,
+                        n_workers: int = 1,
+                        executor: str = 'thread',
+                        **read_kwargs) -> list:
+    """
+    Reads a list of files with read_func, optionally spread across a pool of
+    threads or processes.
+
+    Results are returned in the same order as paths regardless of which
+    worker finished first. Failed reads do not stop the remaining reads, the
+    exception is returned in place of the dataframe instead.
+
+    Parameters
+    ----------
+    paths : list
+        Paths of files to read.
+    read_func : Callable
+        Function reading a single path into a dataframe. Must be defined at
+        module level when executor='process'. The default is read_file.
+    n_workers : int
+        Number of workers in pool. 1 reads files one after another in the
+        current process. The default is 1.
+    executor : str
+        Type of pool to use, 'thread' or 'process'. Threads suit network
+        storage and readers that release the GIL, processes suit CPU-bound
+        parsing such as sas7bdat. The default is 'thread'.
+    **read_kwargs : keyword arguments
+        Passed on to read_func for every path.
+
+    Raises
+    ------
+    ValueError
+        Invalid executor or n_workers input.
+
+    Returns
+    -------
+    results : list
+        List of (dataframe, None) for successful reads and (None, exception)
+        for failed reads, in the same order as paths.
+
+    """
+    allowed_executors = {'thread': ThreadPoolExecutor,
+                         'process': ProcessPoolExecutor}
+
+    if executor not in allowed_executors:
+        raise ValueError(f'Invalid executor. Allowed executors: {list(allowed_executors)}')
+
+    if isinstance(n_workers, int) is False or n_workers < 1:
+        raise ValueError('n_workers must be a positive integer')
+
+    results = []
+
+    # Sequential path, avoids pool overhead for single worker
+    if n_workers == 1 or len(paths) <= 1:
+        for path in paths:
+            try:
+                results.append((read_func(path, **read_kwargs), None))
+            except Exception as error:
+                results.append((None, error))
+
+        return results
+
+    with allowed_executors[executor](max_workers=n_workers) as pool:
+        # Futures are kept in input order, so collecting them in order
+        # preserves ordering of output
+        futures = [pool.submit(read_func, path, **read_kwargs)
+                   for path in paths]
+
+        for future in futures:
+            try:
+                results.append((future.result(), None))
+            except Exception as error:
+                results.append((None, error))
+
+    return results
+
+
+class DatasetHandle():
+    """
+    Load-on-demand reference to a single file.
+
+    Holds the path and read options of a file instead of its data. The file
+    is read when load() is called, and the data is not kept by the handle,
+    so it is released as soon as the caller is done with it.
+    """
+
+    def __init__(self, path: str, cache: 'ImportCache' = None, **read_options):
+        """
+        Parameters
+        ----------
+        path : str
+            Path of file.
+        cache : ImportCache
+            Cache to load file from, and store it in after parsing.
+            The default is None.
+        **read_options : keyword arguments
+            Passed on to read_file.
+        """
+        self.path = path
+        self.cache = cache
+        self.read_options = read_options
+
+        # Constant columns added after load, on form {column : (value, dtype)}
+        self.added_columns = {}
+
+    def add_column(self, name: str, value, dtype=None):
+        """Adds a column with a constant value to the data when loaded,
+        converted to dtype if given"""
+        self.added_columns[name] = (value, dtype)
+
+        return self
+
+    def load(self) -> 'pd.DataFrame':
+        """Reads file and returns it as a dataframe"""
+        df = None
+
+        if self.cache is not None:
+            key = self.cache.make_key(self.path, **self.read_options)
+            df = self.cache.get(key)
+
+        if df is None:
+            df = read_file(self.path, **self.read_options)
+
+            if self.cache is not None:
+                self.cache.put(key, df)
+
+        for name, (value, dtype) in self.added_columns.items():
+            df[name] = constant_column(value, len(df), dtype)
+
+        return df
+
+    def __repr__(self):
+        return f'DatasetHandle({self.path!r})'
+
+
+def _apply_after_load(func: Callable, key, loader: Callable):
+    """Runs loader, then applies func(key, df) to the result"""
+    return func(key, loader())
+
+
+class LazyDatasetDict(MutableMapping):
+    """
+    Dictionary where values are made by a loader function the first time
+    they are accessed.
+
+    Used by DataImporter in lazy mode, so datasets are only concatenated
+    when they are used. Values assigned directly are stored as-is.
+    """
+
+    def __init__(self, loaders: dict = None):
+        """
+        Parameters
+        ----------
+        loaders : dict
+            Dataset names as keys, functions without arguments returning the
+            dataset as values.
+        """
+        self.loaders = dict(loaders or {})
+        self.data = {}
+
+    def __getitem__(self, key):
+        if key not in self.data:
+            # Loader is dropped once used, releasing what it refers to
+            self.data[key] = self.loaders.pop(key)()
+
+        return self.data[key]
+
+    def __setitem__(self, key, value):
+        self.loaders.pop(key, None)
+        self.data[key] = value
+
+    def __delitem__(self, key):
+        if key in self.loaders:
+            del self.loaders[key]
+        else:
+            del self.data[key]
+
+    def __iter__(self):
+        # Keeps order of loaders followed by assigned values
+        return iter(list(self.loaders) + [key for key in self.data
+                                          if key not in self.loaders])
+
+    def __len__(self):
+        return len(set(self.loaders) | set(self.data))
+
+    def apply(self, func: Callable):
+        """
+        Applies func(key, df) to every dataset. Datasets not yet made get
+        func added to their loader instead, so they stay unloaded.
+        """
+        for key in list(self.loaders):
+            self.loaders[key] = partial(_apply_after_load, func, key,
+                                        self.loaders[key])
+
+        for key in list(self.data):
+            if key not in self.loaders:
+                self.data[key] = func(key, self.data[key])
+
+        return self
+
+    def is_loaded(self, key) -> bool:
+        """True if dataset has been made"""
+        return key in self.data
+
+    def materialise(self) -> dict:
+        """Makes all datasets, returns them as a regular dictionary"""
+        return {key: self[key] for key in self}
+
+
 def simple_importer(df:'pd.Dataframe', 
                     path_col:str='path',
                     file_col:str='filename',
                     dir_col:str='directory',
                     filetype:str=None,
                     sep_sign:str=';',
-                    encode:str='iso-8859-1'):
+                    encode:str='iso-8859-1',
+                    usecols:list=None,
+                    dtype:dict=None,
+                    chunksize:int=None,
+                    row_filter:Callable=None,
+                    filters:list=None,
+                    use_threads:bool=True,
+                    n_workers:int=1,
+                    executor:str='thread',
+                    errors:str='raise',
+                    cache:'ImportCache'=None,
+                    lazy:bool=False,
+                    return_report:bool=False):
     """
     Batch import of data from a set of given paths, folder- and filenames.
 
@@ -90,6 +813,13 @@ def simple_importer(df:'pd.Dataframe',
     Input dataframe must have a column with paths, filenames and parent
     directory present.
 
+    Files can be read in parallel by setting n_workers > 1. Ordering of
+    directories and files in the output is the same as for sequential reads.
+
+    If an ImportCache is given, files that have not changed since they were
+    last imported with the same read options are loaded from the cache
+    instead of being parsed again.
+
     Parameters
     ----------
     df : pd.Dataframe
@@ -108,16 +838,64 @@ def simple_importer(df:'pd.Dataframe',
     encode : str,
         Encoding of source datafile. The default is 'iso-8859-1' (anything from SAS
         will have this encoding).
+    usecols : list
+        Lowercase names of columns to keep. For csv and txt files other
+        columns are never loaded. The default is None (all columns).
+    dtype : dict
+        Lowercase column names as keys, datatypes as values. For csv and txt
+        files dtypes are set by the parser, columns not listed are read as
+        str. The default is None.
+    chunksize : int
+        Streams csv, txt and sas7bdat files in chunks of chunksize rows,
+        applying usecols, dtype and row_filter per chunk. Keeps peak memory
+        use of large files bounded. The default is None (whole file at once).
+    row_filter : Callable
+        Function taking a dataframe with lowercase column names and returning
+        a boolean mask of rows to keep. Applied per chunk when chunksize is
+        set. The default is None.
+    filters : list
+        Only used for parquet files. Filters pushed down to the scan so that
+        row groups which cannot match are skipped, e.g. [('aar', '>=', 2010)].
+        The default is None.
+    use_threads : bool
+        Only used for parquet files. Decode each file with multiple threads.
+        The default is True.
+    n_workers : int
+        Number of files to read at the same time. The default is 1.
+    executor : str
+        Pool used when n_workers > 1, 'thread' or 'process'.
+        The default is 'thread'.
+    errors : str
+        'raise' raises the first error encountered when reading files.
+        'report' skips files that fail and lists them in the report.
+        The default is 'raise'.
+    cache : ImportCache
+        On-disk cache to load unchanged files from and store newly parsed
+        files in. The default is None (no caching).
+    lazy : bool
+        If True no files are read. Values in data_dict are DatasetHandle
+        objects that read their file when .load() is called. Errors are then
+        raised on load. The default is False.
+    return_report : bool
+        If True the function returns a tuple of data_dict and a report
+        dictionary. The default is False.
 
     Raises
     ------
     AssertionError
         Invalid filetype input.
+    ValueError
+        Invalid errors input.
 
     Returns
     -------
     data_dict : dict
         Dictionary with foldername, and filename as keys, dataframes as values.
+    report : dict
+        Only returned if return_report is True. Contains number of files read,
+        cache hits and misses, and errors per failed file path under the key
+        'errors'. Cache hits and misses are None in lazy mode, where files
+        are looked up in the cache when loaded.
 
     """
     allowed_filetypes = [
@@ -128,46 +906,293 @@ def simple_importer(df:'pd.Dataframe',
         raise AssertionError(f'Filetype specified not allowed. Allowed filetypes: {allowed_filetypes}')
         return
 
-    # Where data will be stored
-    data_dict = {}
+    if errors not in ['raise', 'report']:
+        raise ValueError("Invalid errors input. Valid inputs are 'raise' and 'report'.")
+
+    # Where data will be stored, directories kept in order of appearance
+    data_dict = {directory: {} for directory in df[dir_col].unique()}
+
+    # Flat list of files to read on form (directory, filename, path)
+    file_list = list(
+        df[[dir_col, file_col, path_col]].itertuples(index=False, name=None))
+
+    read_options = dict(filetype=filetype, sep_sign=sep_sign, encode=encode,
+                        usecols=usecols, dtype=dtype, chunksize=chunksize,
+                        row_filter=row_filter, filters=filters,
+                        use_threads=use_threads)
+
+    if lazy is True:
+        for directory, filename, path in file_list:
+            data_dict[directory][filename] = DatasetHandle(path, cache=cache,
+                                                           **read_options)
+
+        # Files are only read, and looked up in the cache, when loaded
+        report = {'files_read': 0, 'cache_hits': None, 'cache_misses': None,
+                  'errors': {}}
+
+        if return_report is True:
+            return data_dict, report
 
-    for directory in df[dir_col].unique():
+        return data_dict
 
-        # Subset rows to use for file import
-        row_subset = df.loc[df[dir_col] == directory, [path_col, file_col]]
+    report = {'files_read': 0, 'cache_hits': 0, 'cache_misses': 0,
+              'errors': {}}
 
-        # Store subset to dict to enable dict comprehension below
-        file_path_dict = dict(zip(row_subset[file_col], row_subset[path_col]))
+    # Files served from cache, on form {position in file_list : df}
+    cached_data = {}
 
-        # Read in data on form {directory : filename : df} for allowed filetypes
-        # Makes nested dictionary form
-        if filetype in ['csv', 'txt']:
-            data_dict[directory] = {
-                filename : pd.read_csv(path, encoding=encode,
-                                       sep=sep_sign, dtype=str) 
-                    for filename, path in file_path_dict.items()}
+    if cache is not None:
+        cache_keys = [cache.make_key(path, **read_options)
+                      for _, _, path in file_list]
 
-        elif filetype == 'sas7bdat':
-            data_dict[directory] = {
-                filename : pd.read_sas(path, encoding=encode) 
-                    for filename, path in file_path_dict.items()}
+        for position, key in enumerate(cache_keys):
+            data = cache.get(key)
 
-        elif filetype in ['xlsx', 'xls']:
-            data_dict[directory] = {
-                filename : pd.read_excel(path, encoding=encode) 
-                    for filename, path in file_path_dict.items()}
+            if data is not None:
+                cached_data[position] = data
 
-        elif filetype == 'parquet':
-            data_dict[directory] = [pd.read_excel(path, encoding=encode) 
-                    for path in df[path_col]]
+        report['cache_hits'] = len(cached_data)
+        report['cache_misses'] = len(file_list) - len(cached_data)
 
-        # Change column names i df columns for df inside nested dict w 3 levels
-        data_dict = {
-            folder_name: {
-                file_name: (df.rename(columns = lambda x: x.lower(), inplace=False))
-                       for file_name, df in folder_dict.items()
-                       } 
-            for folder_name, folder_dict in data_dict.items()
-        }
+    # Only files not found in cache are parsed
+    positions_to_read = [position for position in range(len(file_list))
+                         if position not in cached_data]
+
+    read_results = read_files_parallel(
+        [file_list[position][2] for position in positions_to_read],
+        read_func=read_file,
+        n_workers=n_workers,
+        executor=executor,
+        **read_options)
+
+    # Store newly parsed files in cache
+    if cache is not None:
+        for position, (data, error) in zip(positions_to_read, read_results):
+            if error is None:
+                cache.put(cache_keys[position], data)
+
+        # Access times of cache hits written once for all files
+        cache.flush()
+
+    # Combine cached and parsed files, in order of file_list
+    results = {position: (data, None)
+               for position, data in cached_data.items()}
+    results.update(zip(positions_to_read, read_results))
+    results = [results[position] for position in range(len(file_list))]
+
+    # Read in data on form {directory : filename : df}
+    for (directory, filename, path), (data, error) in zip(file_list, results):
+
+        if error is not None:
+            if errors == 'raise':
+                raise error
+
+            report['errors'][path] = f'{type(error).__name__}: {error}'
+            continue
+
+        data_dict[directory][filename] = data
+        report['files_read'] += 1
+
+    if return_report is True:
+        return data_dict, report
 
     return data_dict
+
+
+def partition_value(folder_name: str) -> str:
+    """
+    Returns the value of a hive-style partition folder name, i.e. 'aar=2021'
+    gives '2021'. Folder names without '=' are returned unchanged, so plain
+    year folders ('2021') work the same way.
+    """
+    return str(folder_name).split('=', 1)[-1]
+
+
+def year_column(years: list, lengths: list):
+    """
+    Makes a column tagging rows of concatenated dataframes with the year of
+    the dataframe they came from, with years[i] repeated lengths[i] times.
+
+    Years are stored as int16 if all are numeric, and as category otherwise,
+    instead of an object column of strings.
+    """
+    values = [partition_value(year) for year in years]
+
+    if all(value.isnumeric() for value in values):
+        return np.repeat(np.array(values, dtype=np.int16), lengths)
+
+    codes, categories = pd.factorize(pd.Series(values))
+    return pd.Categorical.from_codes(np.repeat(codes, lengths), categories)
+
+
+def constant_column(value, length: int, dtype=None):
+    """Column of length rows with value, of dtype if given, e.g. a
+    CategoricalDtype shared by several dataframes"""
+    if dtype is None:
+        return value
+
+    return pd.Series([value], dtype=dtype).take(np.zeros(length, dtype=int)).array
+
+
+def read_partitioned_dataset(export_path: str,
+                             year_col: str = 'aar',
+                             start_year: int = None,
+                             stop_year: int = None,
+                             filetype: str = 'parquet',
+                             **read_options) -> 'pd.DataFrame':
+    """
+    Reads a dataset written by batch_exporter with layout='hive', i.e. on
+    the form export_path/prefix/aar=2021/part-0.parquet. export_path is
+    then the dataset folder export_path/prefix.
+
+    Partitions are pruned on folder names before any file is opened, so
+    files for years outside start_year and stop_year are never read. The
+    year column is added back from the folder names. Partition folders that
+    are not numeric years (e.g. aar=unknown) are skipped with a warning.
+
+    Parameters
+    ----------
+    export_path : str
+        Dataset folder containing partition folders.
+    year_col : str
+        Name of partition column. The default is 'aar'.
+    start_year : int
+        First year to read. The default is None (no lower limit).
+    stop_year : int
+        Last year to read. The default is None (no upper limit).
+    filetype : str
+        Filetype of partition files. The default is 'parquet'.
+    **read_options : keyword arguments
+        Passed on to read_file, e.g. usecols, dtype or filters.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Data from all partitions within year range, ordered by year.
+
+    """
+    partitions, skipped = [], []
+
+    with os.scandir(export_path) as entries:
+        for entry in entries:
+            if entry.is_dir() and entry.name.startswith(f'{year_col}='):
+                value = partition_value(entry.name)
+
+                # Years must be numeric to be compared and ordered
+                if not value.isnumeric():
+                    skipped.append(entry.name)
+                    continue
+
+                year = int(value)
+
+                in_range = ((start_year is None or year >= start_year) and
+                            (stop_year is None or year <= stop_year))
+
+                if in_range:
+                    partitions.append((year, entry.path))
+
+    if len(skipped) > 0:
+        print(f'Warning: Partition folders {sorted(skipped)} are not numeric years and were skipped')
+
+    # Partition column is not stored in files, read without it and add back
+    usecols = read_options.pop('usecols', None)
+    if usecols is not None:
+        usecols = [str(col).lower() for col in usecols]
+        read_options['usecols'] = [col for col in usecols if col != year_col]
+
+    frames, years = [], []
+
+    for year, folder in sorted(partitions):
+        files = sorted(entry.path for entry in os.scandir(folder)
+                       if entry.is_file() and entry.name.endswith(f'.{filetype}'))
+
+        for path in files:
+            frames.append(read_file(path, filetype=filetype, **read_options))
+            years.append(str(year))
+
+    if len(frames) == 0:
+        return pd.DataFrame(columns=usecols)
+
+    df = pd.concat(frames, ignore_index=True)
+
+    # Year is added once for all partitions
+    df[year_col] = year_column(years, [len(frame) for frame in frames])
+
+    if usecols is not None:
+        df = df[usecols]
+
+    return df
+
+
+def optimise_dtypes(df: 'pd.DataFrame',
+                    year_cols: list = None,
+                    category_ratio: float = 0.5,
+                    downcast_floats: bool = False) -> 'pd.DataFrame':
+    """
+    Reduces memory use of a dataframe by changing datatypes of columns.
+
+    - Year columns are parsed to int16 (Int16 if they contain missing values)
+    - String columns where the number of unique values is low compared to
+      the number of rows are turned into category. Code columns such as
+      naaringskode, produktkode and ytart usually qualify.
+    - Integer columns are downcast to the smallest integer type that holds
+      their values. Float columns are only downcast to float32 if
+      downcast_floats is True, as this loses precision.
+
+    String columns are never parsed to numbers (other than year columns),
+    since codes such as '01' would lose their leading zeros.
+
+    NOTE: Grouping on category columns returns all categories unless
+    observed=True is given to groupby.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Input dataframe.
+    year_cols : list
+        Columns containing years. Columns not present in df are skipped.
+        The default is None, which means ['aar', 'aar_added'].
+    category_ratio : float
+        String columns with unique values / rows below this ratio are turned
+        into category. The default is 0.5.
+    downcast_floats : bool
+        Downcast float64 columns to float32. The default is False.
+
+    Returns
+    -------
+    df : pd.DataFrame
+        Dataframe with optimised datatypes.
+
+    """
+    if year_cols is None:
+        year_cols = ['aar', 'aar_added']
+
+    # Columns are reassigned, never modified in place, so a shallow copy
+    # keeps the input intact without duplicating its data
+    df = df.copy(deep=False)
+
+    for col in df.columns:
+        series = df[col]
+
+        if col in year_cols:
+            years = pd.to_numeric(series, errors='coerce')
+
+            # Only converts if every non-missing value is a year
+            if years.notna().sum() == series.notna().sum():
+                df[col] = years.astype('Int16' if years.isna().any() else 'int16')
+            continue
+
+        if pd.api.types.is_integer_dtype(series.dtype):
+            df[col] = pd.to_numeric(series, downcast='integer')
+
+        elif pd.api.types.is_float_dtype(series.dtype) and downcast_floats is True:
+            df[col] = pd.to_numeric(series, downcast='float')
+
+        elif series.dtype == object and len(series) > 0:
+            # Only strings (and missing values) are turned into category
+            is_string = pd.api.types.infer_dtype(series, skipna=True) == 'string'
+
+            if is_string and series.nunique() / len(series) < category_ratio:
+                df[col] = series.astype('category')
+
+    return df
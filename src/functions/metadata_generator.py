@@ -17,7 +17,9 @@ from typing import List, Callable
 
 from src.functions.logic_helpers import check_listinput
 from src.functions.utility_module import input_argument_none_eliminator
-from src.functions.import_helpers import file_finder, check_files
+from src.functions.import_helpers import (file_finder, check_files,
+                                          load_file_index, search_file_index,
+                                          partition_value)
 
 class FolderSearcher():
     """
@@ -29,7 +31,10 @@ class FolderSearcher():
                 dataset_list:list[str] = None,
                 datatype: str = None,
                 use_numeric_folders: bool = True,
-                list_check_func: Callable = check_listinput):
+                list_check_func: Callable = check_listinput,
+                index_cache_path: str = None,
+                start_year: int = None,
+                stop_year: int = None):
         """
         Initalisation function accepting class attributes.
 
@@ -56,13 +61,25 @@ class FolderSearcher():
             contains anything else than strings, floats and ints. If input is not
             list, contains allowed datatypes or is empty, the function will raise 
             errors.
+        index_cache_path : str
+            Path of file to save the index of files found under filepath to.
+            The saved index is reused in later runs for as long as no folder
+            under filepath has changed. The default is None (no caching).
+        start_year : int
+            First year (subfolder) to import data from. If None the user is
+            prompted for it. The default is None.
+        stop_year : int
+            Last year (subfolder) to import data from. If None the user is
+            prompted for it. The default is None.
         """
         # Typecheck for type, lenght and content of dataset_list
         #list_check_func(dataset_list, 'dataset_list')
 
         # Filepath = directory where sub-folders with data exists.
         self.path = str(filepath)
+        self.index_cache_path = index_cache_path
 
+        self.dataset_list = None
         if isinstance(dataset_list, list):
             self.dataset_list = [str(item).lower() for item in dataset_list]
         
@@ -72,15 +89,31 @@ class FolderSearcher():
         # Variables to store metadata, and imported files
         self.list_of_folders = ()
 
-        # user defined input variables
-        self.start_year = int(input('Start year for data import:'))
-        self.stop_year = int(input('Last year for data import:'))
-        
+        # user defined input variables, prompts user if not given
+        self.start_year = self.__year_or_prompt(start_year, 'Start year for data import:')
+        self.stop_year = self.__year_or_prompt(stop_year, 'Last year for data import:')
+
+    @staticmethod
+    def __year_or_prompt(year: int = None, prompt: str = None) -> int:
+        """Returns year as int. Asks user for year via input() if year is
+        None, so the class can run without a keyboard when years are given."""
+        if year is None:
+            year = input(prompt)
+
+        return int(year)
+
     def set_parameters_multifolder_search(self,
         dataset_list:list[str] = None,
         datatype: str = None,
         use_numeric_folders: bool = True,
-        list_check_func: Callable = check_listinput):
+        list_check_func: Callable = check_listinput,
+        start_year: int = None,
+        stop_year: int = None):
+        """
+        Resets search parameters so the same object can search again.
+        Parameters are the same as for __init__. start_year and stop_year are
+        prompted for if not given.
+        """
         
         if isinstance(dataset_list, list):
             self.dataset_list = [str(item).lower() for item in dataset_list]
@@ -91,9 +124,9 @@ class FolderSearcher():
         # Variables to store metadata, and imported files
         self.list_of_folders = ()
 
-        # user defined input variables
-        self.start_year = int(input('Start year for data import:'))
-        self.stop_year = int(input('Last year for data import:'))
+        # user defined input variables, prompts user if not given
+        self.start_year = self.__year_or_prompt(start_year, 'Start year for data import:')
+        self.stop_year = self.__year_or_prompt(stop_year, 'Last year for data import:')
         
         return self
         
@@ -124,19 +157,23 @@ class FolderSearcher():
         return self.list_of_folders
 
     def __filter_years(self, file_list:list, start_year:int, stop_year:int):
-        """Filter list of years by start and stop year"""
+        """Filter list of year folders by start and stop year. Works for
+        plain year folders (2021) and hive-style folders (aar=2021)."""
 
         if self.use_numeric_folders is not True:
             return file_list
 
         else:
-            __year_vector = pd.Series(data=file_list).astype(int)
+            __year_vector = pd.Series(
+                data=[int(partition_value(folder)) for folder in file_list],
+                index=file_list,
+                dtype=int)
 
             # .loc filters for start and stop
             __filtered_years = list(
                 __year_vector.loc[
                     ((__year_vector >= start_year) & (__year_vector <= stop_year))
-                ]
+                ].index
             )
 
             return __filtered_years
@@ -155,11 +192,12 @@ class FolderSearcher():
         """
         self.__numeric_folders = []
 
-        # Filter out non-numerically named folders
+        # Filter out non-numerically named folders, folders named on the form
+        # aar=2021 count as numeric
         [self.__numeric_folders.append(item)
          for item
          in self.list_of_folders
-         if item.isnumeric()]
+         if partition_value(item).isnumeric()]
 
         self.__numeric_folders = self.__filter_years(
             self.__numeric_folders,
@@ -197,9 +235,6 @@ class FolderSearcher():
 
         """
 
-        # Temp storage, used for listcomps below
-        self.filepaths = []
-
         # Generate input list of files
         self.folder_list = self.read_folders()
 
@@ -207,17 +242,20 @@ class FolderSearcher():
         if select_numeric_folders is True:
             self.folder_list = self.__check_numeric_folders()
 
-        # Generate path from folder and file information
-        for index, year in enumerate(self.folder_list):
+        # Index of all files in subfolders, scanned once (or loaded from
+        # index_cache_path) instead of once per subfolder
+        self.file_index = load_file_index(self.path,
+                                          max_depth=1,
+                                          cache_path=self.index_cache_path)
 
-            # Generate list of files within each sub-folder
-            __files_in_subfolder = file_finder(
-                f'{self.path}/{year}',
-                filter_clauses=self.dataset_list)
+        # Generate path from folder and file information
+        root = self.path.rstrip('/')
+        found_files = search_file_index(
+            self.file_index,
+            filter_clauses=self.dataset_list,
+            dir_paths=[f'{root}/{year}' for year in self.folder_list])
 
-            # Append full filepath to list
-            [self.filepaths.append(f'{self.path}/{year}/{file}') 
-            for file in __files_in_subfolder]
+        self.filepaths = list(found_files['path'])
 
         error_string = "Search terms in dataset_list yielded no results. Please revise search terms."
 
@@ -294,11 +332,12 @@ class FolderSearcher():
             __filepaths, 
             columns=['path']).astype(str)
 
-        # Stores filenames from paths as new column
-        self.metadata_df['filename'] = self.__string_clipper(
-            target_iterable = self.metadata_df['path'],
-            elem_num=-1,
-            )
+        # Stores filenames from paths as new column, in lowercase
+        self.metadata_df['filename'] = [
+            name.lower() for name in self.__string_clipper(
+                target_iterable = self.metadata_df['path'],
+                elem_num=-1,
+                )]
 
         # Gets directory location of files
         self.metadata_df['directory'] = self.__string_clipper(
@@ -438,7 +477,7 @@ class FolderSearcher():
 
         return self
     
-    def subset_energiregnskapet(self) -> pd.DataFrame:
+    def subset_energiregnskapet(self, year: int = None) -> pd.DataFrame:
         """
         Subsets the metadata dataframe to include only files related to a specific year of 'energiregnskapet'.
 
@@ -446,6 +485,9 @@ class FolderSearcher():
         ----------
         self : object
             The instance of the class on which this method operates.
+        year : int
+            Year of energiregnskapet to use. If None the user is prompted for
+            it. The default is None.
 
         Returns
         -------
@@ -467,8 +509,8 @@ class FolderSearcher():
                          'the .output_df() method']
             raise ValueError(' '.join(error_msg))
 
-        # Prompts user for input
-        year = input(' '.join(prompt))
+        # Prompts user for input if year not given
+        year = str(self.__year_or_prompt(year, ' '.join(prompt)))
 
         # Filters out desired subset by column, groups and values
         er_subset = self.metadata_df.loc[
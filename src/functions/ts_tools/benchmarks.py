@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Created on Fri Oct 16 10:02:31 2026
+
+@author: Benedikt Goodman
+@email: benedikt.goodman@ssb.no
+
+Benchmarks for functions in ts_tools. Run from project root with:
+    python -m src.functions.ts_tools.benchmarks
+"""
+
+import time
+import numpy as np
+import pandas as pd
+
+from src.functions.ts_tools.df_generator import df_generator
+from src.functions.ts_tools.ts_agg_disagg import (IncrementalAggregator,
+                                                  aggregation_func,
+                                                  aggregation_func_long,
+                                                  convert_frequency, denton)
+
+
+def time_func(func, *args, repeats=3, **kwargs):
+    """Returns best wall time in seconds of repeats calls to func, and the
+    result of the last call"""
+    timings = []
+
+    for n in range(repeats):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        timings.append(time.perf_counter() - start)
+
+    return min(timings), result
+
+
+def benchmark_aggregation(n_sectors=(10, 100, 500),
+                          date_start='1990-01-01',
+                          date_stop='2022-12-31',
+                          repeats=3):
+    """
+    Compares the 'apply' and 'vectorised' engines of aggregation_func on
+    monthly dataframes with n_sectors columns and some missing values,
+    aggregated to quarters and years.
+
+    Also checks several methods at once on MultiIndex (sector x product)
+    columns against one resample per method.
+
+    Raises AssertionError if the two engines give different results.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Best wall time in seconds per engine and speedup of the vectorised
+        engine.
+    """
+    rows = []
+
+    for n in n_sectors:
+        df = df_generator(n, date_start, date_stop, 'M',
+                          null_value_ratio=0.01, insert_null_values=True)
+
+        for target_freq in ['Q', 'Y']:
+            for method in ['sum', 'mean']:
+                apply_time, apply_result = time_func(
+                    aggregation_func, df, target_freq, method,
+                    engine='apply', repeats=repeats)
+
+                vector_time, vector_result = time_func(
+                    aggregation_func, df, target_freq, method,
+                    engine='vectorised', repeats=repeats)
+
+                pd.testing.assert_frame_equal(apply_result, vector_result)
+
+                rows.append([n, target_freq, method, apply_time, vector_time])
+
+        # Several methods on sector x product columns, against one resample
+        # per method
+        panel = df.copy()
+        panel.columns = pd.MultiIndex.from_tuples([(col % 10, col // 10) for col in range(n)])
+        methods = ['sum', 'last']
+
+        for target_freq in ['Q', 'Y']:
+            multi_result = aggregation_func(panel, target_freq, methods,
+                                            ignore_incomplete=False)
+            expected = pd.concat({method: getattr(panel.resample(target_freq), method)()
+                                  for method in methods}, axis=1)
+            expected = expected.reorder_levels([1, 2, 0], axis=1)[multi_result.columns]
+
+            pd.testing.assert_frame_equal(multi_result, expected)
+
+    results = pd.DataFrame(rows, columns=['n_sectors', 'target_freq', 'method',
+                                          'apply_s', 'vectorised_s'])
+    results['speedup'] = results['apply_s'] / results['vectorised_s']
+
+    return results
+
+
+def benchmark_disaggregation(n_sectors=(10, 100, 500),
+                             date_start='1950-01-01',
+                             date_stop='2022-12-31',
+                             repeats=3):
+    """
+    Compares annual to monthly stair disaggregation done by chaining two
+    resamples (years to quarters to months, as with disagg_func_stairs)
+    with a single call to convert_frequency.
+
+    Raises AssertionError if the two give different results.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Best wall time in seconds per method and speedup of
+        convert_frequency.
+    """
+    rows = []
+
+    def chained(df):
+        df = df.astype(float).resample('Q', convention='start').ffill()
+        return df.astype(float).resample('M', convention='start').ffill()
+
+    for n in n_sectors:
+        df = df_generator(n, date_start, date_stop, 'Y')
+
+        resample_time, resample_result = time_func(chained, df, repeats=repeats)
+        convert_time, convert_result = time_func(convert_frequency, df, 'M',
+                                                 repeats=repeats)
+
+        pd.testing.assert_frame_equal(resample_result, convert_result)
+
+        rows.append([n, resample_time, convert_time])
+
+    results = pd.DataFrame(rows, columns=['n_sectors', 'resample_s', 'convert_s'])
+    results['speedup'] = results['resample_s'] / results['convert_s']
+
+    return results
+
+
+def benchmark_denton(n_series=(10, 100, 250),
+                     start_year='1970',
+                     stop_year='2022',
+                     repeats=3):
+    """
+    Compares the batched banded solver of denton with a dense solve of
+    the full matrices, for annual benchmarks disaggregated to quarters with
+    the proportional and additive methods. Memory use of the dense solve
+    grows with the square of the number of quarters, so keep n_series
+    moderate. A single benchmark year (stop_year only) is also checked, and
+    the default engine='auto' is timed as well.
+
+    Raises AssertionError if the two engines give different results.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Best wall time in seconds per engine and speedup of banded engine.
+    """
+    rng = np.random.default_rng(0)
+    rows = []
+
+    for first_year in [start_year, stop_year]:
+        years = pd.period_range(first_year, stop_year, freq='A')
+        quarters = pd.period_range(f'{first_year}Q1', f'{stop_year}Q4', freq='Q')
+
+        for n in n_series:
+            indicator = pd.DataFrame(
+                100 + np.cumsum(rng.normal(0, 2, (len(quarters), n)), axis=0),
+                index=quarters)
+            benchmarks = pd.DataFrame(
+                indicator.groupby(indicator.index.year).sum().to_numpy()
+                * rng.uniform(0.9, 1.1, (len(years), n)),
+                index=years)
+
+            for method in ['proportional', 'additive']:
+                dense_time, dense_result = time_func(
+                    denton, benchmarks, indicator, method, engine='dense',
+                    repeats=repeats)
+
+                banded_time, banded_result = time_func(
+                    denton, benchmarks, indicator, method, engine='banded',
+                    repeats=repeats)
+
+                auto_time, auto_result = time_func(
+                    denton, benchmarks, indicator, method, repeats=repeats)
+
+                pd.testing.assert_frame_equal(dense_result, banded_result)
+                pd.testing.assert_frame_equal(dense_result, auto_result)
+
+                rows.append([len(years), n, method, dense_time, banded_time,
+                             auto_time])
+
+    results = pd.DataFrame(rows, columns=['n_years', 'n_series', 'method',
+                                          'dense_s', 'banded_s', 'auto_s'])
+    results['speedup'] = results['dense_s'] / results['banded_s']
+
+    return results
+
+
+def benchmark_long_aggregation(n_sectors=(10, 100, 500),
+                               date_start='1990-01-01',
+                               date_stop='2022-12-31',
+                               repeats=3):
+    """
+    Compares aggregation of long-format data (series x period x value) by
+    pivoting to wide, calling aggregation_func and melting back, with a
+    single call to aggregation_func_long.
+
+    Raises AssertionError if the two give different results.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Best wall time in seconds per method and speedup of
+        aggregation_func_long.
+    """
+    rows = []
+
+    def via_wide(long, target_freq, method):
+        wide = long.pivot(index='periode', columns='serie', values='verdi')
+        wide = aggregation_func(wide, target_freq, method)
+        return (wide.melt(var_name='serie', value_name='verdi', ignore_index=False)
+                .reset_index()[['serie', 'periode', 'verdi']]
+                .sort_values(['serie', 'periode'], ignore_index=True))
+
+    for n in n_sectors:
+        wide = df_generator(n, date_start, date_stop, 'M',
+                            null_value_ratio=0.01, insert_null_values=True)
+        wide.columns = [f'serie{col}' for col in range(n)]
+        long = (wide.rename_axis('periode').reset_index()
+                .melt(id_vars='periode', var_name='serie', value_name='verdi'))
+
+        for target_freq in ['Q', 'Y']:
+            for method in ['sum', 'mean']:
+                wide_time, wide_result = time_func(
+                    via_wide, long, target_freq, method, repeats=repeats)
+
+                long_time, long_result = time_func(
+                    aggregation_func_long, long, 'periode', target_freq,
+                    method, group_cols=['serie'], repeats=repeats)
+
+                pd.testing.assert_frame_equal(wide_result, long_result)
+
+                rows.append([n, target_freq, method, wide_time, long_time])
+
+    results = pd.DataFrame(rows, columns=['n_sectors', 'target_freq', 'method',
+                                          'pivot_s', 'long_s'])
+    results['speedup'] = results['pivot_s'] / results['long_s']
+
+    return results
+
+
+def benchmark_incremental(n_sectors=(10, 100, 500),
+                          date_start='1950-01-01',
+                          date_stop='2022-12-31',
+                          n_new=12,
+                          repeats=3):
+    """
+    Compares a monthly refresh where the last n_new months are appended one
+    at a time and the full history is aggregated again after each, with
+    IncrementalAggregator.update on the new month only. The result is read
+    after every append in both cases.
+
+    Raises AssertionError if the two give different results.
+
+    Returns
+    -------
+    results : pd.DataFrame
+        Best wall time in seconds per method for all n_new refreshes and
+        speedup of IncrementalAggregator.
+    """
+    rows = []
+
+    def full(df, target_freq, method):
+        for stop in range(len(df) - n_new + 1, len(df) + 1):
+            result = aggregation_func(df.iloc[:stop], target_freq, method)
+        return result
+
+    def incremental(agg, df):
+        for position in range(len(df) - n_new, len(df)):
+            result = agg.update(df.iloc[position:position + 1]).result
+        return result
+
+    for n in n_sectors:
+        df = df_generator(n, date_start, date_stop, 'M')
+
+        for target_freq in ['Q', 'Y']:
+            method = ['sum', 'last']
+
+            full_time, full_result = time_func(full, df, target_freq, method,
+                                               repeats=repeats)
+
+            # History is aggregated once, outside of timing
+            aggregators = [IncrementalAggregator(df.iloc[:-n_new], target_freq, method)
+                           for repeat in range(repeats)]
+            timings = []
+            for agg in aggregators:
+                timing, incremental_result = time_func(incremental, agg, df, repeats=1)
+                timings.append(timing)
+
+            pd.testing.assert_frame_equal(full_result, incremental_result)
+
+            rows.append([n, target_freq, full_time, min(timings)])
+
+    results = pd.DataFrame(rows, columns=['n_sectors', 'target_freq', 'full_s',
+                                          'incremental_s'])
+    results['speedup'] = results['full_s'] / results['incremental_s']
+
+    return results
+
+
+if __name__ == '__main__':
+    print(benchmark_aggregation().to_string(index=False))
+    print(benchmark_disaggregation().to_string(index=False))
+    print(benchmark_denton().to_string(index=False))
+    print(benchmark_long_aggregation().to_string(index=False))
+    print(benchmark_incremental().to_string(index=False))
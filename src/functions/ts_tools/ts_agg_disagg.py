@@ -12,6 +12,8 @@ import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 
+from functools import lru_cache
+
 def disagg_func_stairs(df, input_freq, output_freq):
     """
     Function that returns a disaggregated version of input dataframe.
@@ -28,7 +30,8 @@ def disagg_func_stairs(df, input_freq, output_freq):
                                |  2020M3  ||1900|
 
     The function can only disaggregate from years to quarters or from
-    quarters to months.
+    quarters to months. See convert_frequency for other frequencies and
+    methods.
 
     It requires period-indexes to work.
 
@@ -66,6 +69,13 @@ def disagg_func_stairs(df, input_freq, output_freq):
         raise IndexError('dataframe must have PeriodIndex with frequency Q or Y')
         return
 
+    # convert_frequency needs consecutive periods. Missing periods take the
+    # value of the period before, as with resample and ffill.
+    full_index = pd.period_range(df.index.min(), df.index.max(),
+                                 freq=df.index.freq, name=df.index.name)
+    if not df.index.equals(full_index):
+        df = df.sort_index().reindex(full_index, method='ffill')
+
     # Branch for quarter to monthly disaggregation
     if input_freq == 'Q' and output_freq == 'M':
 
@@ -74,12 +84,9 @@ def disagg_func_stairs(df, input_freq, output_freq):
 
             # Branch containing disaggregation method
             try:
-                # Ensure all values are numeric
-                df = df.astype(float) 
-
-                # Resampling via forwardfilling - identifies value per period
-                # Then fills that value across resampled period
-                df = df.resample(rule=output_freq, convention='start').ffill()
+                # Copies value of each period to its child periods, values
+                # are converted to float
+                df = convert_frequency(df, output_freq, method='stair')
 
                 return df
 
@@ -104,12 +111,9 @@ def disagg_func_stairs(df, input_freq, output_freq):
         if df.index.dtype == 'period[A-DEC]':
 
             try:
-                # Ensure all values are numeric
-                df = df.astype(float) 
-
-                # Resampling via forwardfilling - identifies value per period
-                # Then fills that value across resampled period
-                df = df.resample(rule=output_freq, convention='start').ffill()
+                # Copies value of each period to its child periods, values
+                # are converted to float
+                df = convert_frequency(df, output_freq, method='stair')
 
                 return df
 
@@ -132,22 +136,182 @@ def disagg_func_stairs(df, input_freq, output_freq):
 
 #%%
 
-def aggregation_func(df, target_freq, aggregation_method, ignore_incomplete=True):
+# Aggregation methods of aggregation_kernel, with FAME equivalents
+aggregation_methods = ['sum', 'mean', 'first', 'last', 'max', 'min']
+
+
+def aggregation_kernel(values, starts, methods, ignore_incomplete=True):
+    """
+    Applies a set of aggregation methods to consecutive blocks of rows in
+    one pass, i.e. to the periods within each target period.
+
+    Block boundaries are computed once by the caller. Every method is then
+    a ufunc.reduceat or a gather over the same boundaries, so asking for
+    several methods does not group the data several times.
+
+    Methods, similar to FAME's aggregation techniques:
+        'sum'   = SUMMED, sum of periods
+        'mean'  = AVERAGED, average of periods
+        'first' = BEGINNING, first observation, for stocks
+        'last'  = ENDING, last observation, for stocks
+        'max'   = HIGH, largest observation
+        'min'   = LOW, smallest observation
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Float array of shape (rows, columns), rows in period order.
+    starts : np.ndarray
+        Position of first row of each block, increasing and starting at 0.
+    methods : list
+        Methods to apply.
+    ignore_incomplete : boolean
+        True = blocks containing missing values are set to missing.
+        False = missing values are skipped, as in resample. Blocks with
+                only missing values give 0 for sum and missing otherwise.
+
+    Returns
+    -------
+    results : dict
+        Array of shape (blocks, columns) per method, and 'null_count' with
+        number of missing values per block and column.
+
+    """
+    n_rows = len(values)
+    valid = ~np.isnan(values)
+    valid_count = np.add.reduceat(valid, starts, axis=0)
+    counts = np.diff(np.r_[starts, n_rows])[:, None]
+
+    results = {'null_count': counts - valid_count}
+
+    if 'sum' in methods or 'mean' in methods:
+        sums = np.add.reduceat(np.where(valid, values, 0), starts, axis=0)
+        if 'sum' in methods:
+            results['sum'] = sums
+        if 'mean' in methods:
+            results['mean'] = np.divide(sums, valid_count, out=np.full(sums.shape, np.nan),
+                                        where=valid_count > 0)
+
+    for method, ufunc, fill in [('max', np.maximum, -np.inf), ('min', np.minimum, np.inf)]:
+        if method in methods:
+            result = ufunc.reduceat(np.where(valid, values, fill), starts, axis=0)
+            result[valid_count == 0] = np.nan
+            results[method] = result
+
+    # Positions of first and last valid row per block and column
+    positions = np.arange(n_rows)[:, None]
+    columns = np.arange(values.shape[1])
+
+    if 'first' in methods:
+        first = np.minimum.reduceat(np.where(valid, positions, n_rows), starts, axis=0)
+        results['first'] = np.where(valid_count > 0, values[first.clip(max=n_rows - 1), columns], np.nan)
+
+    if 'last' in methods:
+        last = np.maximum.reduceat(np.where(valid, positions, -1), starts, axis=0)
+        results['last'] = np.where(valid_count > 0, values[last.clip(min=0), columns], np.nan)
+
+    if ignore_incomplete is True:
+        for method in methods:
+            results[method] = np.where(results['null_count'] > 0, np.nan, results[method])
+
+    return results
+
+
+def target_ordinals(periods, target):
+    """
+    Ordinals of target periods of frequency target for periods, by integer
+    division where the number of periods per target period is fixed, and
+    through the unique periods otherwise.
+    """
+    source = periods.freqstr
+    ordinals = periods.asi8
+
+    if source == target:
+        return ordinals
+
+    if (source, target) in fixed_period_ratios:
+        return ordinals // fixed_period_ratios[(source, target)]
+
+    codes, uniques = pd.factorize(ordinals)
+    unique_targets = pd.PeriodIndex(pd.arrays.PeriodArray(uniques, freq=source)).asfreq(target)
+
+    return unique_targets.asi8[codes]
+
+
+def period_aggregate(df, target_freq, methods, ignore_incomplete=True):
+    """
+    Aggregates a dataframe with a sorted PeriodIndex or DatetimeIndex to
+    target_freq with aggregation_kernel. Gives the same output as resample,
+    including target periods without any input periods.
+
+    A single method gives the same columns as df, a list of methods gives
+    columns (column, method) as resample().agg(list).
+    """
+    target = period_freqs[target_freq]
+    is_datetime = isinstance(df.index, pd.DatetimeIndex)
+
+    if is_datetime:
+        ordinals = df.index.to_period(target).asi8
+    else:
+        ordinals = target_ordinals(df.index, target)
+
+    if (np.diff(ordinals) < 0).any():
+        raise IndexError('Index must be sorted in increasing order')
+
+    starts = np.r_[0, np.flatnonzero(np.diff(ordinals)) + 1]
+    method_list = [methods] if isinstance(methods, str) else list(methods)
+
+    results = aggregation_kernel(df.to_numpy(dtype=float), starts, method_list,
+                                 ignore_incomplete=ignore_incomplete)
+
+    # Target periods without input periods are 0 for sum, missing otherwise
+    index = pd.period_range(pd.Period(ordinal=ordinals[0], freq=target),
+                            pd.Period(ordinal=ordinals[-1], freq=target))
+    positions = ordinals[starts] - ordinals[0]
+
+    output = []
+    for method in method_list:
+        full = np.full((len(index), df.shape[1]), 0.0 if method == 'sum' else np.nan)
+        full[positions] = results[method]
+        output.append(full)
+
+    if is_datetime:
+        index = index.to_timestamp(how='end').normalize()
+
+    index = index.rename(df.index.name)
+
+    if isinstance(methods, str):
+        return pd.DataFrame(output[0], index=index, columns=df.columns)
+
+    # Method added as last level, also when columns are a MultiIndex
+    columns = pd.MultiIndex.from_tuples([(*(col if isinstance(col, tuple) else (col,)), method)
+                                         for col in df.columns for method in method_list])
+
+    return pd.DataFrame(np.stack(output, axis=2).reshape(len(index), -1), index=index,
+                        columns=columns)
+
+
+def aggregation_func(df, target_freq, aggregation_method, ignore_incomplete=True,
+                     engine='vectorised'):
     """
 
-    Aggregation function that outputs mean or sum of input values. Works for
-    however many sectors you want.
+    Aggregation function that outputs mean, sum, first, last, max or min of
+    input values. Works for however many sectors you want.
 
     It can only aggregate. I.e. the function will return errors
     if desired output periodicity is higher than the input.
 
-    The function has two aggregation methods, sum and mean. These
-    are similar to FAME's SUMMED and AVERAGED aggregation techniques.
-
-    sum will take the value of each input period and output the sum of these
-    within each aggregated group of periods.
+    The aggregation methods are similar to FAME's aggregation techniques:
+        sum   = SUMMED, sum of input periods within each aggregated period
+        mean  = AVERAGED, average across grouped input periods
+        first = BEGINNING, first observation, for stocks
+        last  = ENDING, last observation, for stocks
+        max   = HIGH, largest observation
+        min   = LOW, smallest observation
 
-    mean will output the average across grouped input periods.
+    Several methods can be requested at once, e.g. ['sum', 'last']. The
+    periods are then grouped once and all methods applied in the same pass
+    (see aggregation_kernel).
 
     Parameters
     ----------
@@ -158,16 +322,24 @@ def aggregation_func(df, target_freq, aggregation_method, ignore_incomplete=True
             'M' = months
             'Q' = quarter
             'Y' = year
-    aggregation_method: String.
-        Decides aggregation method. Valid inputs are 'mean' or 'sum'.
+    aggregation_method: String or list.
+        Decides aggregation method. Valid inputs are 'mean', 'sum', 'first',
+        'last', 'max' and 'min', or a list of these.
     ignore_incomplete: boolean.
         True = function will not aggregate periods containing missing values.
         False = function aggregates all periods, but will output a warning if
                 missing values are detected
+    engine: String.
+        'vectorised' = aggregation_kernel over period boundaries computed
+                       once. Default.
+        'apply' = applies a Python function per column per period when
+                  ignore_incomplete = True. Slow on wide dataframes, only
+                  supports a single 'sum' or 'mean', kept for comparison.
     Returns
     -------
     df : Pandas dataframe.
-        Aggregated dataframe
+        Aggregated dataframe. If aggregation_method is a list, columns are
+        (column, method) as with resample().agg(list).
 
     """
     # Creates local boolean variable to test if df is a dataframe
@@ -186,15 +358,17 @@ def aggregation_func(df, target_freq, aggregation_method, ignore_incomplete=True
     allowed_freqs = ['M','Q','Y']
 
     # define allowed aggregation methods
-    allowed_methods = ['mean', 'sum']
+    allowed_methods = aggregation_methods
+    method_list = ([aggregation_method] if isinstance(aggregation_method, str)
+                   else list(aggregation_method))
 
     # Define dict of allowed combos, then reverse keys and values
     allowed_combos = { i : allowed_dtypes[i] for i in range(0, len(allowed_dtypes)) }
     allowed_combos = {v: k for k, v in allowed_combos.items()}
 
     # Extract input index type, then assign to values in dict
-    input_idx_type = df.index.dtype
-    input_idx_num = allowed_combos[input_idx_type]
+    input_idx_type = str(df.index.dtype)
+    input_idx_num = allowed_combos.get(input_idx_type)
 
     # assign values to allowed target_frequencies
     target_freq_vals = {'D': 1, 'M' : 2, 'Q' : 3, 'Y' : 4 }
@@ -212,10 +386,16 @@ def aggregation_func(df, target_freq, aggregation_method, ignore_incomplete=True
                          "'Q' and 'Y'.")
         return
 
-    # aggregation method not sum or mean
-    elif aggregation_method not in allowed_methods:
+    # aggregation method not among allowed methods
+    elif len(method_list) == 0 or any(method not in allowed_methods for method in method_list):
         raise ValueError('Invalid aggregation_method input. Valid methods are \n'
-                         "'mean' and 'sum'.")
+                         f'{allowed_methods}, or a list of these.')
+        return
+
+    # engine not vectorised or apply
+    elif engine not in ['vectorised', 'apply']:
+        raise ValueError("Invalid engine input. Valid engines are 'vectorised' \n"
+                         "and 'apply'.")
         return
 
     # ignore incomplete not of boolean type
@@ -225,8 +405,14 @@ def aggregation_func(df, target_freq, aggregation_method, ignore_incomplete=True
                          'or False')
         return
 
+    # apply engine only has null-checking sum and mean
+    elif engine == 'apply' and aggregation_method not in ['mean', 'sum']:
+        raise ValueError("The apply engine only supports a single 'mean' or 'sum' \n"
+                         "aggregation_method.")
+        return
+
     # incorrect index type on input df
-    elif df.index.dtype not in allowed_dtypes:
+    elif input_idx_type not in allowed_dtypes:
         raise IndexError("Invalid index type in input dataframe. Supported \n"
                          "indexes are currently datetime64[ns] and period.")
         return
@@ -244,8 +430,18 @@ def aggregation_func(df, target_freq, aggregation_method, ignore_incomplete=True
     # It checks if df is a dataframe, and that arguments are strings
     if is_df is True and type(target_freq) is str and target_freq in allowed_freqs:
 
-        # Path taken if periods with nulls are NOT to be aggregated
-        if ignore_incomplete == True:
+        # All methods, with or without nulls, in one pass over the periods
+        if engine == 'vectorised':
+
+            if ignore_incomplete == False and df.isnull().values.any():
+                print("Null values present in output dataframe. \n"
+                      "Ensure that output dataframe contains desired output \n"
+                      )
+
+            return period_aggregate(df, target_freq, aggregation_method,
+                                    ignore_incomplete=ignore_incomplete)
+
+        elif ignore_incomplete == True:
 
             if aggregation_method == 'mean':
 
@@ -304,3 +500,713 @@ def aggregation_func(df, target_freq, aggregation_method, ignore_incomplete=True
 
     else:
         pass
+
+
+class IncrementalAggregator():
+    """
+    Keeps the result of aggregation_func up to date as new periods are
+    appended to the input, without aggregating the full history again.
+
+    Only the input rows of the last target period are kept as state. When
+    new rows are appended, these rows and the new rows are aggregated with
+    aggregation_func, and only the target periods they cover are replaced
+    in the result. All earlier target periods are final, since the input
+    only grows at the end. The cost of an update therefore depends on the
+    number of new rows, not on the length of the history.
+
+    Aggregated values are kept in a buffer that grows by doubling, and
+    result is a dataframe over this buffer, so reading it after each update
+    does not copy the history either. result therefore shares memory with
+    the aggregator: its last period is updated in place when more input
+    periods of it are appended. Use result.copy() to keep a snapshot or to
+    change the values.
+
+    Example, monthly data aggregated to quarters:
+        agg = IncrementalAggregator(df_history, 'Q', 'sum')
+        agg.update(df_new_month)
+        agg.result
+    """
+
+    def __init__(self, df, target_freq, aggregation_method, ignore_incomplete=True):
+        """
+        Parameters
+        ----------
+        df : Pandas dataframe.
+            History to aggregate, indexed as for aggregation_func and sorted.
+        target_freq : String.
+            Desired frequency of output. 'M', 'Q' or 'Y'.
+        aggregation_method : String or list.
+            'mean', 'sum', 'first', 'last', 'max' or 'min', or a list of
+            these.
+        ignore_incomplete : boolean.
+            As in aggregation_func. The default is True.
+        """
+        if type(df).__name__ != 'DataFrame':
+            raise TypeError('df is not a dataframe')
+
+        if len(df) == 0:
+            raise ValueError('df must contain at least one period')
+
+        self.target_freq = target_freq
+        self.aggregation_method = aggregation_method
+        self.ignore_incomplete = ignore_incomplete
+
+        # Input rows of last target period
+        self.tail = df.iloc[:0]
+
+        # Aggregated values and index values (ordinals) per target period,
+        # of which the first n_closed are final and the next one is open
+        self.__values = None
+        self.__ordinals = None
+        self.__index = None
+        self.__columns = None
+        self.n_closed = 0
+        self.__result = None
+
+        self.update(df)
+
+    def __target_ordinals(self, index):
+        target = period_freqs[self.target_freq]
+
+        if isinstance(index, pd.DatetimeIndex):
+            return index.to_period(target).asi8
+
+        return target_ordinals(index, target)
+
+    def update(self, df_new):
+        """
+        Appends new rows to the input and updates the affected target
+        periods of the result.
+
+        Parameters
+        ----------
+        df_new : Pandas dataframe.
+            New periods, with the same columns and index type as the data
+            already aggregated, and later than all of it.
+
+        Raises
+        ------
+        ValueError
+            Columns differ from the data already aggregated.
+        IndexError
+            Index not sorted, or not later than the data already aggregated.
+
+        Returns
+        -------
+        self
+
+        """
+        if len(df_new) == 0:
+            return self
+
+        if not df_new.columns.equals(self.tail.columns):
+            raise ValueError('Columns of df_new must equal columns of the data '
+                             'already aggregated')
+
+        if not (df_new.index.is_monotonic_increasing and df_new.index.is_unique):
+            raise IndexError('Index of df_new must be sorted in increasing order '
+                             'without duplicates')
+
+        if len(self.tail) > 0 and df_new.index[0] <= self.tail.index[-1]:
+            raise IndexError('Index of df_new must start after the last period '
+                             f'already aggregated: {self.tail.index[-1]}')
+
+        df = pd.concat([self.tail, df_new])
+
+        aggregated = aggregation_func(df, self.target_freq, self.aggregation_method,
+                                      ignore_incomplete=self.ignore_incomplete)
+
+        # First aggregated period is the open period from before. Periods
+        # before the last one cannot change anymore.
+        self.__write(aggregated)
+        self.n_closed += len(aggregated) - 1
+
+        ordinals = self.__target_ordinals(df.index)
+        self.tail = df.iloc[np.searchsorted(ordinals, ordinals[-1]):]
+
+        self.__result = None
+
+        return self
+
+    def __write(self, aggregated):
+        """Writes aggregated periods to buffers from the open period on,
+        doubling buffers when they are full"""
+        if self.__values is None:
+            self.__values = np.empty((0, aggregated.shape[1]))
+            self.__ordinals = np.empty(0, dtype=np.int64)
+            self.__index = aggregated.index[:0]
+            self.__columns = aggregated.columns
+
+        stop = self.n_closed + len(aggregated)
+
+        if stop > len(self.__values):
+            capacity = max(stop, 2 * len(self.__values))
+            values = np.empty((capacity, self.__values.shape[1]))
+            ordinals = np.empty(capacity, dtype=np.int64)
+            values[:self.n_closed] = self.__values[:self.n_closed]
+            ordinals[:self.n_closed] = self.__ordinals[:self.n_closed]
+            self.__values, self.__ordinals = values, ordinals
+
+        self.__values[self.n_closed:stop] = aggregated.to_numpy()
+        self.__ordinals[self.n_closed:stop] = aggregated.index.asi8
+
+    @property
+    def result(self):
+        """Aggregated dataframe, as aggregation_func would give for all
+        data appended so far. Shares memory with the aggregator."""
+        if self.__result is None:
+            stop = self.n_closed + 1
+            template = self.__index
+
+            if isinstance(template, pd.PeriodIndex):
+                index = pd.PeriodIndex(pd.arrays.PeriodArray(self.__ordinals[:stop],
+                                                             freq=template.freq))
+            # Frequency is set from three periods on, as by to_timestamp
+            else:
+                freq = period_freqs[self.target_freq] if stop >= 3 else None
+                index = pd.DatetimeIndex(self.__ordinals[:stop].view('M8[ns]'),
+                                         freq=freq)
+
+            self.__result = pd.DataFrame(self.__values[:stop], copy=False,
+                                         index=index.rename(template.name),
+                                         columns=self.__columns)
+
+        return self.__result
+
+#%%
+
+# Period frequencies used by convert_frequency, finest last
+period_freqs = {'Y': 'A-DEC', 'A': 'A-DEC', 'Q': 'Q-DEC', 'M': 'M',
+                'W': 'W-SUN', 'D': 'D'}
+
+# Pairs where every child period lies within one parent period. Weeks do
+# not fit within months, quarters or years.
+nested_pairs = {
+    'A-DEC': ['Q-DEC', 'M', 'D'],
+    'Q-DEC': ['M', 'D'],
+    'M': ['D'],
+    'W-SUN': ['D'],
+    }
+
+
+@lru_cache(maxsize=128)
+def period_mapping(start, end, output_freq):
+    """
+    Maps parent periods from start to end onto the child periods of
+    output_freq within them. Cached by (start, end, frequencies), so panels
+    covering the same periods share one mapping.
+
+    Parameters
+    ----------
+    start : pd.Period
+        First parent period.
+    end : pd.Period
+        Last parent period, of same frequency as start.
+    output_freq : string
+        Child frequency, one of the values in period_freqs.
+
+    Returns
+    -------
+    mapping : dict
+        'index'   = PeriodIndex of child periods
+        'parent'  = position of parent of each child
+        'counts'  = number of children of each child's parent
+        'left', 'right', 'weight' = positions of parents before and after
+                    each child and weight of right parent, for linear
+                    interpolation between parent midpoints
+        Arrays are read-only since they are shared between calls.
+
+    """
+    index = pd.period_range(start.start_time, end.end_time, freq=output_freq)
+
+    parent = index.asfreq(start.freqstr).asi8 - start.ordinal
+    counts = np.bincount(parent)
+
+    # Position of each child within its parent, and parent midpoints on the
+    # same scale as child positions
+    first_child = np.cumsum(counts) - counts
+    midpoints = first_child + (counts - 1) / 2
+    positions = np.arange(len(index))
+
+    right = np.searchsorted(midpoints, positions, side='right').clip(1, max(len(counts) - 1, 1))
+    left = right - 1
+    if len(counts) == 1:
+        right = left = np.zeros(len(index), dtype=np.int64)
+        weight = np.zeros(len(index))
+    else:
+        weight = ((positions - midpoints[left]) / (midpoints[right] - midpoints[left])).clip(0, 1)
+
+    mapping = {'index': index, 'parent': parent, 'counts': counts[parent],
+               'left': left, 'right': right, 'weight': weight}
+
+    for value in mapping.values():
+        if isinstance(value, np.ndarray):
+            value.setflags(write=False)
+
+    return mapping
+
+
+def convert_frequency(df, output_freq, method='stair', input_freq=None):
+    """
+    Disaggregates a dataframe with a PeriodIndex to a higher frequency,
+    i.e. years to quarters, months or days, quarters to months or days,
+    months to days or weeks to days.
+
+    The mapping from parent to child periods is made once per span of
+    periods and frequency pair and cached (see period_mapping). All columns
+    are then converted together with a single NumPy gather.
+
+    Methods:
+        'stair'       = value of parent copied to each child, as
+                        disagg_func_stairs. Suitable for levels and rates.
+        'even'        = value of parent split evenly between children, so
+                        children sum to parent. Suitable for flows.
+        'interpolate' = linear interpolation between parent values placed
+                        at the middle of each parent period, constant
+                        before the first and after the last midpoint.
+
+    Example, method='even'
+        Original data           |timeperiod||value|
+                                |  2020Q1  ||1900|
+
+        Transformed data       |timeperiod||value|
+                               |  2020M1  ||633.3|
+                               |  2020M2  ||633.3|
+                               |  2020M3  ||633.3|
+
+    Parameters
+    ----------
+    df : dataframe
+        Input dataframe with PeriodIndex of consecutive periods.
+    output_freq : string
+        Frequency of output. 'Q', 'M' or 'D'. Weeks do not fit within
+        months, quarters or years, so 'W' is only an input frequency.
+    method : string
+        'stair', 'even' or 'interpolate'. The default is 'stair'.
+    input_freq : string
+        Frequency of input, 'Y'/'A', 'Q', 'M' or 'W'. The default is None,
+        which infers it from the index.
+
+    Returns
+    -------
+    df : dataframe
+        Disaggregated version of input dataframe, with float values.
+
+    """
+    allowed_methods = ['stair', 'even', 'interpolate']
+
+    if type(df).__name__ != 'DataFrame':
+        raise TypeError('df must be a dataframe')
+
+    if method not in allowed_methods:
+        raise ValueError(f'Invalid method input. Valid methods are {allowed_methods}')
+
+    if not isinstance(df.index, pd.PeriodIndex):
+        raise IndexError('dataframe must have PeriodIndex')
+
+    if output_freq not in period_freqs:
+        raise ValueError(f'Invalid output_freq input. Valid inputs are {list(period_freqs)}')
+
+    parent_freq = df.index.freqstr if input_freq is None else period_freqs.get(input_freq)
+    child_freq = period_freqs[output_freq]
+
+    if df.index.freqstr != parent_freq:
+        raise IndexError(f'Index frequency {df.index.freqstr} does not match input_freq {input_freq}')
+
+    if child_freq not in nested_pairs.get(parent_freq, []):
+        raise ValueError(f'Cannot convert from {parent_freq} to {child_freq}. Supported \n'
+                         f'conversions are {nested_pairs}')
+
+    if len(df) == 0:
+        raise IndexError('dataframe is empty')
+
+    start, end = df.index[0], df.index[-1]
+
+    if not np.array_equal(df.index.asi8, np.arange(start.ordinal, end.ordinal + 1)):
+        raise IndexError('Index must contain consecutive periods in increasing order')
+
+    try:
+        values = df.to_numpy(dtype=float)
+    except (TypeError, ValueError):
+        raise TypeError('Dataframe contains non-numeric datatypes \n'
+                        'which cannot be converted to numeric. Check \n'
+                        'dataframe datatypes with df.info() or df.dtypes')
+
+    mapping = period_mapping(start, end, child_freq)
+
+    if method == 'stair':
+        result = values[mapping['parent']]
+
+    elif method == 'even':
+        result = values[mapping['parent']] / mapping['counts'][:, None]
+
+    elif method == 'interpolate':
+        weight = mapping['weight'][:, None]
+        result = (1 - weight) * values[mapping['left']] + weight * values[mapping['right']]
+
+    return pd.DataFrame(result, index=mapping['index'].rename(df.index.name),
+                        columns=df.columns)
+
+#%%
+
+def _solve_banded_batch(band, rhs, bandwidth):
+    """
+    Solves a batch of banded linear systems by Gaussian elimination without
+    pivoting, vectorised over the batch.
+
+    Parameters
+    ----------
+    band : np.ndarray
+        Matrices in band storage, shape (batch, N, 2 * bandwidth + 1), where
+        band[b, i, j - i + bandwidth] = A[b, i, j]. Changed in place.
+    rhs : np.ndarray
+        Right hand sides, shape (batch, N, n_rhs). Changed in place.
+    bandwidth : int
+        Number of diagonals on each side of the main diagonal.
+
+    Returns
+    -------
+    x : np.ndarray
+        Solutions, shape (batch, N, n_rhs).
+
+    """
+    n = band.shape[1]
+    offsets = np.arange(1, bandwidth + 1)
+    upper = np.arange(bandwidth, 2 * bandwidth + 1)
+
+    # Forward elimination, all rows below pivot updated in one step
+    for k in range(n - 1):
+        rows = k + offsets[offsets < n - k]
+        r = rows - k
+
+        factors = band[:, rows, bandwidth - r] / band[:, k, bandwidth][:, None]
+        cols = (bandwidth - r)[:, None] + np.arange(bandwidth + 1)
+        band[:, rows[:, None], cols] -= factors[:, :, None] * band[:, k, upper][:, None, :]
+        rhs[:, rows] -= factors[:, :, None] * rhs[:, k][:, None, :]
+
+    # Back substitution
+    x = np.zeros_like(rhs)
+
+    for k in range(n - 1, -1, -1):
+        stop = min(bandwidth, n - 1 - k)
+        known = np.einsum('bj,bjr->br', band[:, k, bandwidth + 1:bandwidth + 1 + stop],
+                          x[:, k + 1:k + 1 + stop])
+        x[:, k] = (rhs[:, k] - known) / band[:, k, bandwidth][:, None]
+
+    return x
+
+
+def denton(df_low, df_indicator, method='proportional', conversion='sum',
+           engine='auto'):
+    """
+    Temporal disaggregation with the Denton method, as the modified
+    (Cholette) Denton used for benchmarking quarterly national accounts.
+
+    Distributes each low frequency value (e.g. annual benchmark) over its
+    high frequency periods (e.g. quarters) so that the high frequency
+    series sums (or averages) to the benchmarks, while following the
+    movements of an indicator series as closely as possible:
+
+        'proportional' = minimises sum of squared changes in the ratio
+                         between output and indicator. Default.
+        'additive'     = minimises sum of squared changes in the difference
+                         between output and indicator.
+
+    The problem for each series is a banded linear system with the
+    benchmark constraints placed next to their periods. The systems of all
+    columns in the panel are factorised together in one batched banded
+    elimination, so time grows linearly with both number of series and
+    number of periods. For the additive method all series share one
+    matrix, which is factorised once. engine='dense' instead solves the
+    full matrices with np.linalg.solve. Its cost grows with the cube of the
+    number of periods, but it has less overhead per period, so it is
+    faster for short series and few matrices.
+
+    Parameters
+    ----------
+    df_low : dataframe
+        Benchmarks with PeriodIndex of consecutive periods, e.g. years.
+    df_indicator : dataframe
+        Indicator series with the same columns as df_low and PeriodIndex
+        covering exactly the child periods of df_low, e.g. quarters. Values
+        must be non-zero for the proportional method.
+    method : string
+        'proportional' or 'additive'. The default is 'proportional'.
+    conversion : string
+        'sum' if benchmarks are sums of child periods (flows), 'mean' if
+        they are averages. The default is 'sum'.
+    engine : string
+        'banded', 'dense' or 'auto'. 'auto' uses the dense solve while the
+        number of matrices times the cube of their size is at most 2e8
+        (e.g. up to about 125 years of quarters for one matrix, or 50 years
+        of quarters for 10 series with the proportional method), and the
+        banded solve otherwise. The default is 'auto'.
+
+    Returns
+    -------
+    df : dataframe
+        Disaggregated series with index and columns of df_indicator.
+
+    """
+    if method not in ['proportional', 'additive']:
+        raise ValueError("Invalid method input. Valid methods are 'proportional' and 'additive'")
+
+    if conversion not in ['sum', 'mean']:
+        raise ValueError("Invalid conversion input. Valid inputs are 'sum' and 'mean'")
+
+    if engine not in ['banded', 'dense', 'auto']:
+        raise ValueError("Invalid engine input. Valid engines are 'banded', 'dense' and 'auto'")
+
+    if not (isinstance(df_low.index, pd.PeriodIndex) and isinstance(df_indicator.index, pd.PeriodIndex)):
+        raise IndexError('df_low and df_indicator must have PeriodIndex')
+
+    if df_indicator.index.freqstr not in nested_pairs.get(df_low.index.freqstr, []):
+        raise ValueError(f'Cannot disaggregate from {df_low.index.freqstr} to {df_indicator.index.freqstr}')
+
+    start, end = df_low.index[0], df_low.index[-1]
+
+    if not np.array_equal(df_low.index.asi8, np.arange(start.ordinal, end.ordinal + 1)):
+        raise IndexError('df_low index must contain consecutive periods in increasing order')
+
+    mapping = period_mapping(start, end, df_indicator.index.freqstr)
+
+    if not df_indicator.index.equals(mapping['index']):
+        raise IndexError('df_indicator must cover exactly the periods of df_low')
+
+    indicator = df_indicator[df_low.columns].to_numpy(dtype=float).T
+    benchmarks = df_low.to_numpy(dtype=float).T
+
+    if np.isnan(indicator).any() or np.isnan(benchmarks).any():
+        raise ValueError('Input contains missing values')
+
+    if method == 'proportional' and (indicator == 0).any():
+        raise ValueError('Indicator contains zeros, which the proportional method cannot use')
+
+    parent, counts = mapping['parent'], mapping['counts']
+    n_child, n_parent = len(parent), len(benchmarks.T)
+    n = n_child + n_parent
+
+    # Constraints placed before the last child of each parent. The first
+    # differences penalty is singular over all children, so placing a
+    # constraint after them gives a zero pivot when there is one parent
+    last_child = np.cumsum(np.bincount(parent)) - 1
+    is_last = np.zeros(n_child, dtype=int)
+    is_last[last_child] = 1
+    pos_child = np.arange(n_child) + parent + is_last
+    pos_parent = last_child + np.arange(n_parent)
+    bandwidth = max(int(counts.max()), 2)
+
+    # Aggregate of indicator per parent
+    first_child = last_child + 1 - np.bincount(parent)
+    indicator_low = np.add.reduceat(indicator, first_child, axis=1)
+    if conversion == 'mean':
+        indicator_low = indicator_low / np.bincount(parent)
+
+    # Weights of children in constraints. For the proportional method the
+    # unknowns are ratios to indicator, scaled per series for numerical
+    # stability, which does not change the solution
+    if method == 'proportional':
+        ratio_scale = indicator / np.abs(indicator).mean(axis=1, keepdims=True)
+        weights = ratio_scale
+        targets = benchmarks
+    else:
+        weights = np.ones((1, n_child))
+        targets = benchmarks - indicator_low
+
+    if conversion == 'mean':
+        weights = weights / counts
+
+    # First differences penalty: 2 on diagonal, 1 at ends, -1 next to diagonal
+    diagonal = np.full(n_child, 2.0)
+    diagonal[[0, -1]] = 1.0
+
+    batch = len(weights)
+    band = np.zeros((batch, n, 2 * bandwidth + 1))
+    band[:, pos_child, bandwidth] = diagonal
+    band[:, pos_child[:-1], bandwidth + pos_child[1:] - pos_child[:-1]] = -1.0
+    band[:, pos_child[1:], bandwidth - (pos_child[1:] - pos_child[:-1])] = -1.0
+    band[:, pos_child, bandwidth + pos_parent[parent] - pos_child] = weights
+    band[:, pos_parent[parent], bandwidth - (pos_parent[parent] - pos_child)] = weights
+
+    # Proportional: one matrix and right hand side per series
+    # Additive: one shared matrix with a right hand side per series
+    n_rhs = len(targets) // batch
+    rhs = np.zeros((batch, n, n_rhs))
+    rhs[:, pos_parent] = targets.reshape(batch, n_rhs, n_parent).transpose(0, 2, 1)
+
+    # Break-even of the two solves, measured on annual to quarterly and
+    # monthly benchmarking
+    if engine == 'auto':
+        engine = 'dense' if batch * n**3 <= 2e8 else 'banded'
+
+    if engine == 'banded':
+        solution = _solve_banded_batch(band, rhs, bandwidth)
+
+    else:
+        rows = np.arange(n)[:, None]
+        cols = rows + np.arange(-bandwidth, bandwidth + 1)
+        valid = (cols >= 0) & (cols < n)
+        dense = np.zeros((batch, n, n))
+        dense[:, np.broadcast_to(rows, cols.shape)[valid], cols[valid]] = band[:, valid]
+        solution = np.linalg.solve(dense, rhs)
+
+    # Children of solution, one row per series
+    solution = solution[:, pos_child].transpose(0, 2, 1).reshape(-1, n_child)
+
+    if method == 'proportional':
+        result = solution * ratio_scale
+    else:
+        result = indicator + solution
+
+    return pd.DataFrame(result.T, index=df_indicator.index, columns=df_low.columns)
+
+#%%
+
+# Number of input periods per target period where it is fixed, so target
+# period ordinals are input ordinals divided by it
+fixed_period_ratios = {('M', 'Q-DEC'): 3, ('M', 'A-DEC'): 12, ('Q-DEC', 'A-DEC'): 4}
+
+
+def aggregation_func_long(df, period_col, target_freq, aggregation_method,
+                          value_cols=None, group_cols=None,
+                          ignore_incomplete=True, require_all_periods=False):
+    """
+    Aggregation of long-format data, i.e. one row per series and period
+    such as product x industry x period x value, without pivoting to one
+    column per series first. Otherwise works as aggregation_func.
+
+    Periods are mapped to target periods by integer division of period
+    ordinals where the number of periods per target period is fixed
+    (months, quarters, years), and through the unique periods otherwise
+    (days). Values are then aggregated with a single groupby on the
+    grouping keys and target period, which also counts missing values.
+    All requested methods are applied to the same grouping.
+
+    Parameters
+    ----------
+    df : Pandas dataframe.
+        Data in long format.
+    period_col : String.
+        Column with periods (period dtype) or dates (datetime64).
+    target_freq : String.
+        Desired frequency of output. 'M', 'Q' or 'Y'.
+    aggregation_method : String or list.
+        'mean', 'sum', 'first', 'last', 'max' or 'min', or a list of
+        these. first and last follow period order within each series.
+    value_cols : list.
+        Columns to aggregate. The default is None, which means all columns
+        not in period_col or group_cols.
+    group_cols : list.
+        Columns identifying each series, e.g. ['produktkode', 'naering'].
+        The default is None, which means a single series.
+    ignore_incomplete : boolean.
+        True = target periods containing missing values are set to missing.
+        False = all periods aggregated, warning printed if missing values
+                are detected. The default is True.
+    require_all_periods : boolean.
+        If True, target periods are also set to missing when rows for some
+        of their periods are absent, as they would be after a pivot to
+        wide format. Only applies when period_col contains periods.
+        The default is False.
+
+    Returns
+    -------
+    df : Pandas dataframe.
+        Aggregated data in long format, with group_cols, period_col as
+        target periods and value_cols, sorted by group and period. If
+        aggregation_method is a list, value columns are named
+        {column}_{method}.
+
+    """
+    freq_levels = {'D': 1, 'M': 2, 'Q-DEC': 3, 'A-DEC': 4}
+    method_list = ([aggregation_method] if isinstance(aggregation_method, str)
+                   else list(aggregation_method))
+
+    if type(df).__name__ != 'DataFrame':
+        raise TypeError('df is not a dataframe')
+
+    if target_freq not in ['M', 'Q', 'Y']:
+        raise ValueError("Invalid target_freq input. Valid inputs are 'M' \n,"
+                         "'Q' and 'Y'.")
+
+    if len(method_list) == 0 or any(method not in aggregation_methods for method in method_list):
+        raise ValueError('Invalid aggregation_method input. Valid methods are \n'
+                         f'{aggregation_methods}, or a list of these.')
+
+    if isinstance(group_cols, str):
+        group_cols = [group_cols]
+    group_cols = [] if group_cols is None else list(group_cols)
+
+    if value_cols is None:
+        value_cols = [col for col in df.columns if col not in group_cols + [period_col]]
+    elif isinstance(value_cols, str):
+        value_cols = [value_cols]
+
+    target = period_freqs[target_freq]
+    periods = df[period_col]
+
+    # Dates are put in target periods directly
+    if pd.api.types.is_datetime64_any_dtype(periods):
+        periods = periods.dt.to_period(target)
+
+    if not isinstance(periods.dtype, pd.PeriodDtype):
+        raise IndexError('period_col must contain periods or dates')
+
+    source = periods.dtype.freq.freqstr
+
+    if freq_levels.get(source, 0) > freq_levels[target]:
+        raise IndexError('Input period frequency lower than desired output frequency. \n'
+                         'Make sure periods are of a more frequent periodicity than desired output')
+
+    ordinals = periods.array.asi8
+
+    if source == target:
+        target_ordinals = ordinals
+    elif (source, target) in fixed_period_ratios:
+        target_ordinals = ordinals // fixed_period_ratios[(source, target)]
+    else:
+        codes, uniques = pd.factorize(ordinals)
+        unique_targets = pd.PeriodIndex(pd.arrays.PeriodArray(uniques, freq=source)).asfreq(target)
+        target_ordinals = unique_targets.asi8[codes]
+
+    target_periods = pd.Series(pd.arrays.PeriodArray(target_ordinals, freq=target),
+                               index=df.index, name=period_col)
+
+    values = df[value_cols]
+    keys = [df[col] for col in group_cols] + [target_periods]
+
+    # first and last are taken in row order within groups, so rows are put
+    # in period order first
+    if 'first' in method_list or 'last' in method_list:
+        order = np.argsort(ordinals, kind='stable')
+        values, keys = values.take(order), [key.take(order) for key in keys]
+
+    # One grouping used for all methods, counts and sizes
+    grouped = values.groupby(keys)
+
+    if isinstance(aggregation_method, str):
+        result = grouped.agg(aggregation_method)
+    else:
+        result = grouped.agg(method_list)
+        result.columns = [f'{col}_{method}' for col, method in result.columns]
+
+    null_count = grouped.size().to_numpy()[:, None] - grouped.count().to_numpy()
+    null_count = np.repeat(null_count, len(method_list), axis=1)
+
+    if ignore_incomplete is True:
+        incomplete = null_count > 0
+
+        if require_all_periods is True:
+            out_periods = result.index.get_level_values(period_col)
+            expected = (out_periods.asfreq(source, 'end').asi8
+                        - out_periods.asfreq(source, 'start').asi8 + 1)
+            incomplete = incomplete | (grouped.size().to_numpy() < expected)[:, None]
+
+        result = result.mask(incomplete)
+
+    elif null_count.any():
+        print("Null values present in output dataframe. \n"
+              "Ensure that output dataframe contains desired output \n"
+              )
+
+    return result.reset_index()